@@ -2,6 +2,10 @@ from django import forms
 from ckeditor.widgets import CKEditorWidget
 from django.contrib import admin
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
 from .models import *
 
 
@@ -77,6 +81,62 @@ class ArticleAdmin(admin.ModelAdmin):
     form = ArticleAdminForm
 
 
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'created_at', 'run_after', 'locked_at', 'processed_at')
+    list_filter = ('status', 'name')
+
+
+@admin.register(ProfileRecord)
+class ProfileRecordAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'view_name', 'label', 'path', 'duration_ms', 'query_count', 'samples', 'status_code')
+    list_filter = ('view_name', 'label')
+    search_fields = ('path', 'label')
+    exclude = ('collapsed_stacks', 'sql_log')
+    readonly_fields = ('label', 'path', 'view_name', 'user', 'status_code', 'duration_ms', 'samples', 'query_count',
+                       'created_at', 'collapsed_download', 'top_stacks', 'sql_queries')
+
+    TOP_STACKS = 30
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/collapsed/', self.admin_site.admin_view(self.collapsed_view),
+                 name='alcohol_profilerecord_collapsed'),
+        ] + super().get_urls()
+
+    def collapsed_view(self, request, pk):
+        record = get_object_or_404(ProfileRecord, pk=pk)
+        response = HttpResponse(record.collapsed_stacks, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="profile-{record.pk}.collapsed"'
+        return response
+
+    @admin.display(description='Стеки для flamegraph')
+    def collapsed_download(self, obj):
+        return format_html('<a href="{}">Скачать (flamegraph.pl, speedscope)</a>',
+                           reverse('admin:alcohol_profilerecord_collapsed', args=[obj.pk]))
+
+    @admin.display(description='Самые частые стеки')
+    def top_stacks(self, obj):
+        lines = obj.collapsed_stacks.splitlines()[:self.TOP_STACKS]
+        rows = (line.rsplit(' ', 1) for line in lines)
+        return format_html(
+            '<table>{}</table>',
+            format_html_join('', '<tr><td>{}</td><td><code>{}</code></td></tr>',
+                             ((count, ' ; '.join(stack.split(';')[-4:])) for stack, count in rows))
+        )
+
+    @admin.display(description='SQL')
+    def sql_queries(self, obj):
+        return format_html(
+            '<table>{}</table>',
+            format_html_join('', '<tr><td>{}</td><td><code>{}</code><br><small>{}</small></td></tr>',
+                             ((query['ms'], query['sql'], ', '.join(query['params'])) for query in obj.sql_log))
+        )
+
+
 admin.site.register(BottleVolume)
 admin.site.register(CartProduct)
 admin.site.register(Order)
@@ -0,0 +1,114 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.db import DatabaseError
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from utils.generations import bump as bump_generations, generation
+
+from .search import tokenize
+
+AUTOCOMPLETE_GENERATION = 'catalog'
+AUTOCOMPLETE_LIMIT = 10
+# the generation is checked at most this often (seconds), so a keystroke does not cost a database query
+AUTOCOMPLETE_VERSION_CHECK_INTERVAL = 1
+
+
+def normalize(text):
+    return ' '.join(tokenize(text))
+
+
+def search_url(query):
+    return f"{reverse('search')}?{urlencode({'search': query})}"
+
+
+def autocomplete_entries():
+    from .models import Brand, Category, Product
+
+    for category in Category.objects.only('name', 'slug'):
+        yield category.name, 'category', category.get_absolute_url()
+    for brand in Brand.objects.only('name'):
+        yield brand.name, 'brand', search_url(brand.name)
+    products = Product.objects.filter(brand__isnull=False).select_related('category', 'brand').only(
+        'name', 'slug', 'category__slug', 'brand__slug'
+    )
+    for product in products:
+        yield product.name, 'product', product.get_absolute_url()
+
+
+# Sorted array of (normalized word-suffix of a name, entry number) pairs. Every word
+# boundary of a name is a key, so 'red' finds 'Carranca Redondo'. Looked up with
+# bisect, rebuilt as a whole when the catalog generation counter moves (checked once a second)
+class AutocompleteIndex:
+
+    def __init__(self):
+        self._data = ([], [], [])
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def build(self):
+        entries = []
+        pairs = []
+        for label, kind, url in autocomplete_entries():
+            words = normalize(label).split()
+            if not words:
+                continue
+            number = len(entries)
+            entries.append({'label': label, 'kind': kind, 'url': url})
+            for position in range(len(words)):
+                pairs.append((' '.join(words[position:]), position, number))
+        pairs.sort()
+        return [key for key, _, _ in pairs], [number for _, _, number in pairs], entries
+
+    def load(self):
+        version = get_version()
+        keys, refs, entries = self.build()
+        with self._lock:
+            self._data = keys, refs, entries
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def warm(self):
+        try:
+            self.load()
+        except DatabaseError:
+            self._version = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < AUTOCOMPLETE_VERSION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if self._version is None or get_version() != self._version:
+            self.load()
+
+    def lookup(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        self.refresh()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        keys, refs, entries = self._data
+        position = bisect_left(keys, prefix)
+        found = []
+        seen = set()
+        while position < len(keys) and keys[position].startswith(prefix) and len(found) < limit:
+            number = refs[position]
+            if number not in seen:
+                seen.add(number)
+                found.append(entries[number])
+            position += 1
+        return found
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def get_version():
+    return generation(AUTOCOMPLETE_GENERATION)
+
+
+def bump_version():
+    bump_generations(AUTOCOMPLETE_GENERATION)
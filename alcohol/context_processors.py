@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from utils.page_cache import tag_versions
+from .models import Category
+
+FRAGMENT_TAGS = ('categories', 'sliders', 'banners')
+
+
+# the category queryset is lazy: it only runs when a {% cache %} fragment that uses it misses; fragment
+# versions are the shared page tag generations, so every worker drops its copy after a change
+def catalog(request):
+    return {
+        'categories': Category.objects.all(),
+        'fragment_versions': SimpleLazyObject(lambda: tag_versions(FRAGMENT_TAGS)),
+        'fragment_cache_timeout': getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24),
+    }
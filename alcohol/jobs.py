@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.db import transaction
+from django.utils.safestring import mark_safe
+
+from utils.jobs import register_job
+from utils.renditions import generate_renditions, rendition_fields
+from .models import (
+    Baner, Brand, Customer, Notification, Product, Slider, invalidate_banner_pages, invalidate_brand_pages,
+    invalidate_product_pages, invalidate_slider_pages
+)
+
+# cached pages and fragments keep the plain image until the renditions exist
+RENDITION_PAGE_INVALIDATORS = {
+    Product: invalidate_product_pages,
+    Brand: invalidate_brand_pages,
+    Slider: invalidate_slider_pages,
+    Baner: invalidate_banner_pages,
+}
+
+
+@register_job('restock_notifications')
+def send_restock_notifications(product_id):
+    product = Product.objects.select_related('category', 'brand').filter(id=product_id).first()
+    if not product:
+        return
+    wishlist = Customer.wishlist.through.objects.filter(product_id=product_id)
+    customer_ids = list(wishlist.values_list('customer_id', flat=True))
+    if not customer_ids:
+        return
+    text = mark_safe(f'Товар, <a href="{product.get_absolute_url()}">{product.name}</a>, '
+                     f'который вы ожидаете, есть в наличии')
+    with transaction.atomic():
+        Notification.objects.notify_many(customer_ids, text)
+        wishlist.filter(customer_id__in=customer_ids).delete()
+
+
+@register_job('generate_renditions')
+def generate_image_renditions(model, pk, field):
+    instance = apps.get_model(model)._default_manager.filter(pk=pk).first()
+    if not instance:
+        return
+    field_file = getattr(instance, field)
+    if field_file:
+        generate_renditions(field_file, rendition_fields(instance)[field])
+        invalidate_pages = RENDITION_PAGE_INVALIDATORS.get(type(instance))
+        if invalidate_pages:
+            invalidate_pages(instance=instance)
@@ -0,0 +1,200 @@
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from utils.seed import seed_catalog
+from .bench_funnel import BENCH_CACHES, current_commit, percentile
+
+PERCENTILES = (50, 95, 99)
+RESULT_TIMEOUT = 60
+
+# "before" is the stock SQLite setup: rollback journal, no pragmas, deferred transactions
+PROFILES = {
+    'before': {'SQLITE_PRAGMAS': {}, 'SQLITE_IMMEDIATE_TRANSACTIONS': False},
+    'after': {'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS, 'SQLITE_IMMEDIATE_TRANSACTIONS': True},
+}
+
+
+def run_worker(role, client, urls, duration, seed, barrier, results):
+    rnd = random.Random(seed)
+    latencies = []
+    errors = locked = 0
+    barrier.wait(RESULT_TIMEOUT)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        requests = rnd.choice(urls)
+        for method, url, data in requests:
+            started = time.perf_counter()
+            try:
+                response = getattr(client, method)(url, data, HTTP_REFERER='/')
+            except Exception as e:
+                errors += 1
+                locked += 'locked' in str(e)
+                break
+            if response.status_code >= 400:
+                errors += 1
+                break
+            latencies.append((time.perf_counter() - started) * 1000)
+    connections.close_all()
+    results.put({'role': role, 'latencies': latencies, 'errors': errors, 'locked': locked})
+
+
+class Command(BaseCommand):
+    help = ('Конкурентная нагрузка на корзину в файловой SQLite: пропускная способность записи и чтения '
+            'без профиля SQLite и с ним (WAL, pragmas, BEGIN IMMEDIATE)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4, help='Процессов, добавляющих товары в корзину')
+        parser.add_argument('--readers', type=int, default=4, help='Процессов, открывающих страницы каталога')
+        parser.add_argument('--duration', type=float, default=10, help='Секунд нагрузки на профиль')
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--profile', choices=tuple(PROFILES), action='append',
+                            help='Профили для замера (по умолчанию все)')
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if connection.vendor != 'sqlite':
+            raise CommandError('Замер имеет смысл только для SQLite')
+        if options['writers'] < 1:
+            raise CommandError('Нужен хотя бы один пишущий процесс')
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment(debug=False)
+        try:
+            with tempfile.TemporaryDirectory() as workdir, override_settings(CACHES=BENCH_CACHES):
+                template, catalog = self.create_template(workdir, options)
+                profiles = {
+                    name: self.run_profile(name, template, catalog, workdir, options)
+                    for name in options['profile'] or PROFILES
+                }
+        finally:
+            connections.close_all()
+            connection.settings_dict['NAME'] = old_name
+            teardown_test_environment()
+
+        report = {
+            'commit': current_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'writers': options['writers'],
+            'readers': options['readers'],
+            'duration': options['duration'],
+            'products': options['products'],
+            'seed': options['seed'],
+            'profiles': profiles,
+        }
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
+        self.print_summary(self.stdout if options['output'] else self.stderr, profiles)
+
+    def use_database(self, path):
+        connections.close_all()
+        connections['default'].settings_dict['NAME'] = path
+
+    def create_template(self, workdir, options):
+        path = os.path.join(workdir, 'template.sqlite3')
+        self.use_database(path)
+        call_command('migrate', verbosity=0, interactive=False)
+        catalog = seed_catalog(products=options['products'], categories=4, brands=10,
+                               customers=options['writers'] + options['readers'], orders_per_customer=0,
+                               cart_lines=0, seed=options['seed'])
+        # closing the last connection checkpoints the WAL into the file that is copied
+        connections.close_all()
+        return path, catalog
+
+    def run_profile(self, name, template, catalog, workdir, options):
+        overrides = PROFILES[name]
+        path = os.path.join(workdir, f'{name}.sqlite3')
+        shutil.copy(template, path)
+        db = sqlite3.connect(path)
+        db.execute(f"PRAGMA journal_mode = {overrides['SQLITE_PRAGMAS'].get('journal_mode', 'delete')}")
+        db.close()
+
+        brand_slugs = {brand.id: brand.slug for brand in catalog.brands}
+        category_slugs = {category.id: category.slug for category in catalog.categories}
+        write_urls = []
+        read_urls = []
+        for product in catalog.products:
+            kwargs = {'ct_model': product.ct_model, 'slug': product.slug}
+            write_urls.append((
+                ('get', reverse('add_to_cart', kwargs=kwargs), None),
+                ('post', reverse('change_qty', kwargs=kwargs), {'qty': 2}),
+                ('get', reverse('delete_from_cart', kwargs=kwargs), None),
+            ))
+            read_urls.append((('get', reverse('product_detail', kwargs={
+                'category_slug': category_slugs[product.category_id], 'brand_slug': brand_slugs[product.brand_id],
+                'product_slug': product.slug
+            }), None),))
+        read_urls.extend((('get', reverse('category_detail', kwargs={'category_slug': slug}), None),)
+                         for slug in category_slugs.values())
+
+        context = multiprocessing.get_context('fork')
+        workers = options['writers'] + options['readers']
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = []
+        with override_settings(**overrides):
+            self.use_database(path)
+            clients = []
+            for customer in catalog.customers[:workers]:
+                client = Client()
+                client.force_login(customer.user)
+                clients.append(client)
+            connections.close_all()
+            for number, client in enumerate(clients):
+                role = 'write' if number < options['writers'] else 'read'
+                process = context.Process(target=run_worker, args=(
+                    role, client, write_urls if role == 'write' else read_urls, options['duration'],
+                    options['seed'] + number, barrier, results
+                ))
+                process.start()
+                processes.append(process)
+            collected = [results.get(timeout=options['duration'] + RESULT_TIMEOUT) for _ in processes]
+            for process in processes:
+                process.join()
+
+        stats = {}
+        for role in ('write', 'read'):
+            latencies = [value for result in collected if result['role'] == role for value in result['latencies']]
+            stats[role] = {
+                'requests': len(latencies),
+                'per_second': round(len(latencies) / options['duration'], 1),
+                'errors': sum(result['errors'] for result in collected if result['role'] == role),
+                'locked': sum(result['locked'] for result in collected if result['role'] == role),
+                **{f'p{p}_ms': round(percentile(latencies, p), 3) if latencies else None for p in PERCENTILES},
+            }
+        return stats
+
+    @staticmethod
+    def print_summary(out, profiles):
+        out.write(f"{'профиль':<10}{'нагрузка':<10}{'запр/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}"
+                  f"{'ошибки':>8}{'locked':>8}")
+        before = profiles.get('before')
+        for name, stats in profiles.items():
+            for role, role_stats in stats.items():
+                line = f"{name:<10}{role:<10}{role_stats['per_second']:>10.1f}" + ''.join(
+                    f"{role_stats[f'p{p}_ms']:>10.2f}" if role_stats[f'p{p}_ms'] is not None else f"{'-':>10}"
+                    for p in PERCENTILES
+                ) + f"{role_stats['errors']:>8}{role_stats['locked']:>8}"
+                if before and name != 'before' and before[role]['per_second']:
+                    change = (role_stats['per_second'] - before[role]['per_second']) / before[role]['per_second']
+                    line += f"  {change * 100:+.1f}%"
+                out.write(line)
@@ -0,0 +1,179 @@
+import json
+import subprocess
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from utils.seed import seed_catalog
+
+FUNNEL_STEPS = (
+    'index', 'catalog', 'category', 'filtered_category', 'product_detail',
+    'add_to_cart', 'change_qty', 'checkout', 'make_order',
+)
+PERCENTILES = (50, 95, 99)
+BENCH_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-funnel'}}
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест воронки покупки на синтетическом каталоге в тестовой базе (p50/p95/p99 и число запросов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--brands', type=int, default=40)
+        parser.add_argument('--customers', type=int, default=20)
+        parser.add_argument('--iterations', type=int, default=50, help='Проходов воронки на замер')
+        parser.add_argument('--warmup', type=int, default=10, help='Проходов воронки без замера')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Файл для JSON-отчета (по умолчанию stdout)')
+        parser.add_argument('--compare', help='JSON-отчет предыдущего запуска для сравнения')
+
+    def handle(self, *args, **options):
+        if options['products'] < options['categories'] or options['customers'] < 1:
+            raise CommandError('Нужен хотя бы один товар на категорию и хотя бы один покупатель')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CACHES=BENCH_CACHES):
+                report = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
+        self.print_summary(self.stdout if options['output'] else self.stderr, report, baseline)
+
+    def run_benchmark(self, options):
+        started = time.perf_counter()
+        catalog = seed_catalog(products=options['products'], categories=options['categories'],
+                               brands=options['brands'], customers=options['customers'], seed=options['seed'])
+        seed_seconds = time.perf_counter() - started
+        timings = {step: [] for step in FUNNEL_STEPS}
+        queries = {step: [] for step in FUNNEL_STEPS}
+        errors = {step: 0 for step in FUNNEL_STEPS}
+        brand_slugs = {brand.id: brand.slug for brand in catalog.brands}
+        clients = {}
+        addresses = {}
+        for iteration in range(options['warmup'] + options['iterations']):
+            customer = catalog.customers[iteration % len(catalog.customers)]
+            client = clients.get(customer.id)
+            if client is None:
+                client = clients[customer.id] = Client()
+                client.force_login(customer.user)
+                addresses[customer.id] = customer.addresses.values_list('id', flat=True).first()
+            measured = iteration >= options['warmup']
+            funnel = self.funnel(catalog, brand_slugs, customer, addresses[customer.id], iteration)
+            for step, method, url, data, extra in funnel:
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    request_started = time.perf_counter()
+                    response = getattr(client, method)(url, data, **extra)
+                    elapsed = time.perf_counter() - request_started
+                if not measured:
+                    continue
+                timings[step].append(elapsed * 1000)
+                queries[step].append(counter.count)
+                if response.status_code >= 400:
+                    errors[step] += 1
+
+        steps = {}
+        for step in FUNNEL_STEPS:
+            steps[step] = {
+                'requests': len(timings[step]),
+                'errors': errors[step],
+                'mean_ms': round(sum(timings[step]) / len(timings[step]), 3),
+                **{f'p{p}_ms': round(percentile(timings[step], p), 3) for p in PERCENTILES},
+                'max_ms': round(max(timings[step]), 3),
+                'queries': {
+                    'min': min(queries[step]),
+                    'p50': percentile(queries[step], 50),
+                    'max': max(queries[step]),
+                },
+            }
+        return {
+            'commit': current_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'catalog': catalog.counts(),
+            'seed': options['seed'],
+            'seed_seconds': round(seed_seconds, 3),
+            'warmup': options['warmup'],
+            'iterations': options['iterations'],
+            'steps': steps,
+        }
+
+    def funnel(self, catalog, brand_slugs, customer, address_id, iteration):
+        category = catalog.categories[iteration % len(catalog.categories)]
+        products = [product for product in catalog.products if product.category_id == category.id]
+        product = products[iteration % len(products)]
+        product_url = reverse('product_detail', kwargs={
+            'category_slug': category.slug, 'brand_slug': brand_slugs[product.brand_id], 'product_slug': product.slug
+        })
+        category_url = reverse('category_detail', kwargs={'category_slug': category.slug})
+        cart_kwargs = {'ct_model': product.ct_model, 'slug': product.slug}
+        referer = {'HTTP_REFERER': product_url}
+        return (
+            ('index', 'get', reverse('index'), None, {}),
+            ('catalog', 'get', reverse('categories'), None, {}),
+            ('category', 'get', category_url, None, {}),
+            ('filtered_category', 'get', category_url,
+             {'region': 'Коньяк', 'strength_min': '37', 'price_max': '20000', 'sort': 'price'}, {}),
+            ('product_detail', 'get', product_url, None, {}),
+            ('add_to_cart', 'get', reverse('add_to_cart', kwargs=cart_kwargs), None, referer),
+            ('change_qty', 'post', reverse('change_qty', kwargs=cart_kwargs), {'qty': 2}, referer),
+            ('checkout', 'get', reverse('checkout'), None, {}),
+            ('make_order', 'post', reverse('make_order'), {
+                'first_name': customer.user.first_name, 'last_name': customer.user.last_name,
+                'phone': customer.phone, 'address': address_id, 'buying_type': 'Доставка', 'comment': ''
+            }, {}),
+        )
+
+    @staticmethod
+    def print_summary(out, report, baseline=None):
+        out.write(f"{'шаг':<18}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'запросы':>12}{'ошибки':>8}")
+        for step, stats in report['steps'].items():
+            line = (f"{step:<18}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+                    f"{stats['queries']['p50']:>6}/{stats['queries']['max']:<5}{stats['errors']:>8}")
+            previous = (baseline or {}).get('steps', {}).get(step)
+            if previous:
+                change = (stats['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+                line += f"  p95 {change:+.1f}%  запросы {stats['queries']['max'] - previous['queries']['max']:+d}"
+            out.write(line)
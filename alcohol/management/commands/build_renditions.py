@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from alcohol.models import BackgroundJob
+from utils.renditions import RENDITION_FIELDS, generate_renditions, renditions_missing
+
+
+class Command(BaseCommand):
+    help = 'Создает уменьшенные копии изображений для всех пресетов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help='Создать копии сразу, а не через очередь задач')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие копии')
+
+    def handle(self, *args, **options):
+        total = 0
+        for label, fields in RENDITION_FIELDS.items():
+            model = apps.get_model(label)
+            for instance in model._default_manager.only('pk', *fields).iterator():
+                for field, presets in fields.items():
+                    field_file = getattr(instance, field)
+                    if not field_file:
+                        continue
+                    if not options['force'] and not renditions_missing(field_file, presets):
+                        continue
+                    if options['now']:
+                        try:
+                            generate_renditions(field_file, presets)
+                        except OSError as e:
+                            self.stderr.write(f'{label} {instance.pk} {field}: {e}')
+                            continue
+                    else:
+                        BackgroundJob.objects.enqueue('generate_renditions', model=label, pk=instance.pk, field=field)
+                    total += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано изображений: {total}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from alcohol.search import search_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--if-empty', action='store_true', help='Перестроить только если индекс пуст')
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and not search_index.is_empty():
+            self.stdout.write('Индекс уже заполнен')
+            return
+        search_index.rebuild()
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
@@ -0,0 +1,45 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from alcohol.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги корзин и исправляет расхождения с товарами корзины'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--include-ordered', action='store_true',
+                            help='Проверять также корзины оформленных заказов')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.all() if options['include_ordered'] else Cart.objects.filter(in_order=False)
+        carts = carts.annotate(
+            actual_total_products=Coalesce(models.Sum('products__qty'), 0),
+            actual_final_price=Coalesce(
+                models.Sum('products__final_price'), models.Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=9, decimal_places=2)
+            )
+        ).only('id', 'total_products', 'final_price').order_by('id')
+        batch = []
+        fixed = 0
+        for cart in carts.iterator(chunk_size=options['batch_size']):
+            if cart.total_products == cart.actual_total_products and cart.final_price == cart.actual_final_price:
+                continue
+            cart.total_products = cart.actual_total_products
+            cart.final_price = cart.actual_final_price
+            batch.append(cart)
+            if len(batch) >= options['batch_size']:
+                fixed += self.save_batch(batch)
+                batch = []
+        fixed += self.save_batch(batch)
+        self.stdout.write(self.style.SUCCESS(f'Исправлено корзин: {fixed}'))
+
+    @staticmethod
+    def save_batch(batch):
+        with transaction.atomic():
+            Cart.objects.bulk_update(batch, ['total_products', 'final_price'])
+        return len(batch)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils.jobs import autodiscover_jobs, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь фоновых задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать очередь один раз и завершиться')
+        parser.add_argument('--limit', type=int, default=100)
+        parser.add_argument('--sleep', type=float, default=2.0, help='Пауза между проверками пустой очереди, сек.')
+
+    def handle(self, *args, **options):
+        autodiscover_jobs()
+        while True:
+            processed = run_pending(limit=options['limit'])
+            if processed:
+                self.stdout.write(f'Обработано задач: {processed}')
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.8 on 2026-10-18 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_cart_product_fk(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    CartProduct = apps.get_model('alcohol', 'CartProduct')
+    Product = apps.get_model('alcohol', 'Product')
+    content_type = ContentType.objects.filter(app_label='alcohol', model='product').first()
+    if content_type:
+        # lines of deleted products keep a dangling object_id and stay without the foreign key
+        CartProduct.objects.filter(
+            content_type=content_type, product__isnull=True, object_id__in=Product.objects.values('id')
+        ).update(product_id=models.F('object_id'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('alcohol', '0033_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartproduct',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='alcohol.product', verbose_name='Товар'),
+        ),
+        migrations.RunPython(fill_cart_product_fk, migrations.RunPython.noop),
+    ]
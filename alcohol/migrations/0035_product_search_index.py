@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from alcohol.search import get_backend
+
+
+def create_search_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.vendor)
+    if backend:
+        with schema_editor.connection.cursor() as cursor:
+            backend.create(cursor)
+
+
+def drop_search_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.vendor)
+    if backend:
+        with schema_editor.connection.cursor() as cursor:
+            backend.drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alcohol', '0034_cartproduct_product'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alcohol', '0035_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], name='alcohol_pro_categor_bc0993_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'out_of_stock'], name='alcohol_pro_categor_1e663a_idx'),
+        ),
+    ]
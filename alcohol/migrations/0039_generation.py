@@ -0,0 +1,25 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alcohol', '0038_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Generation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=100, unique=True, verbose_name='Пространство имен')),
+                ('value', models.BigIntegerField(default=0, verbose_name='Поколение')),
+            ],
+            options={
+                'verbose_name': 'Поколение кэша',
+                'verbose_name_plural': 'Поколения кэшей',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('alcohol', '0039_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Взята в работу'),
+        ),
+        migrations.AddField(
+            model_name='backgroundjob',
+            name='run_after',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Не раньше'),
+        ),
+    ]
@@ -1,6 +1,16 @@
+import hashlib
+import json
+
 from django import views
 from .models import Cart, Customer, Notification
+from django.contrib import messages
 from django.core.exceptions import PermissionDenied
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from utils.page_cache import (
+    get_cached_page, is_cacheable_request, is_cacheable_response, normalized_query, store_page
+)
 
 
 class NotificationMixin(views.generic.detail.SingleObjectMixin):
@@ -8,8 +18,8 @@ class NotificationMixin(views.generic.detail.SingleObjectMixin):
     @staticmethod
     def notifications(user):
         if user.is_authenticated:
-            return Notification.objects.all(user.customer)
-        return Notification.objects.none()
+            return Notification.objects.for_header(user)
+        return {'unread': 0, 'latest': []}
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -19,22 +29,55 @@ class NotificationMixin(views.generic.detail.SingleObjectMixin):
 
 class CartMixin(views.generic.detail.SingleObjectMixin, views.View):
 
+    CART_SESSION_KEY = 'cart'
+
     def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            if not customer:
-                customer = Customer.objects.create(
-                    user=request.user
-                )
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
+        self.cart = SimpleLazyObject(self.get_cart)
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_cart(self):
+        user_id = self.request.user.pk if self.request.user.is_authenticated else None
+        pinned = self.request.session.get(self.CART_SESSION_KEY)
+        if pinned and pinned['user_id'] != user_id:
+            pinned = None
+        if pinned:
+            cart = Cart.objects.filter(id=pinned['cart_id'], in_order=False).first()
+            if cart:
+                return cart
+        if user_id:
+            customer_id = pinned['customer_id'] if pinned else self.get_customer_id()
+            cart = Cart.objects.filter(owner_id=customer_id, in_order=False).first()
             if not cart:
-                cart = Cart.objects.create(owner=customer)
+                cart = Cart.objects.create(owner_id=customer_id)
         else:
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
-        self.cart = cart
-        return super().dispatch(request, *args, **kwargs)
+            cart = Cart.objects.create(for_anonymous_user=True)
+        self.pin_cart(cart)
+        return cart
+
+    def get_customer_id(self):
+        customer = Customer.objects.filter(user=self.request.user).only('id').first()
+        if not customer:
+            customer = Customer.objects.create(
+                user=self.request.user
+            )
+        return customer.id
+
+    def pin_cart(self, cart):
+        self.request.session[self.CART_SESSION_KEY] = {
+            'user_id': self.request.user.pk if self.request.user.is_authenticated else None,
+            'customer_id': cart.owner_id,
+            'cart_id': cart.id,
+            'total_products': cart.total_products,
+            'final_price': str(cart.final_price or 0),
+        }
+
+    @property
+    def cart_summary(self):
+        pinned = self.request.session.get(self.CART_SESSION_KEY)
+        user_id = self.request.user.pk if self.request.user.is_authenticated else None
+        if pinned and pinned['user_id'] == user_id:
+            return pinned
+        return None
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -42,6 +85,95 @@ class CartMixin(views.generic.detail.SingleObjectMixin, views.View):
         return context
 
 
+class AnonymousPageCacheMixin:
+    page_cache_tags = ('categories',)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return super().dispatch(request, *args, **kwargs)
+        request.page_cache = True
+        response = get_cached_page(request)
+        if response is not None:
+            response['X-Page-Cache'] = 'hit'
+            return get_conditional_response(
+                request, etag=response.get('ETag'),
+                last_modified=parse_http_date_safe(response.get('Last-Modified', '')), response=response
+            )
+        response = super().dispatch(request, *args, **kwargs)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.add_post_render_callback(lambda rendered: self.store_page(request, rendered))
+        else:
+            self.store_page(request, response)
+        return response
+
+    def store_page(self, request, response):
+        response['X-Page-Cache'] = 'miss'
+        if is_cacheable_response(request, response):
+            store_page(request, response, self.get_page_cache_tags())
+
+    def get_page_cache_tags(self):
+        return list(self.page_cache_tags)
+
+
+# answers If-None-Match / If-Modified-Since before the view does any work. get_validator_timestamps()
+# returns the updated_at values the page is built from (one indexed query) or None to skip validation;
+# the ETag also covers the query string and, for a logged in user, the cart and notifications in the header
+class ConditionalGetMixin:
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        timestamps = self.get_validator_timestamps()
+        if not timestamps:
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(timestamps)
+        response = None
+        # pending messages are shown by a full render only
+        if not len(messages.get_messages(request)):
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        # rendering may pin the cart to the session, so the ETag is taken from the rendered state
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.add_post_render_callback(lambda rendered: self.set_validators(rendered, timestamps))
+        else:
+            self.set_validators(response, timestamps, etag, last_modified)
+        return response
+
+    def set_validators(self, response, timestamps, etag=None, last_modified=None):
+        if response.status_code not in (200, 304):
+            return
+        if etag is None:
+            etag, last_modified = self.get_validators(timestamps)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        if self.request.user.is_authenticated:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+
+    def get_validator_timestamps(self):
+        return None
+
+    def get_validators(self, timestamps):
+        timestamps = [timestamp for timestamp in timestamps if timestamp]
+        parts = [timestamp.isoformat() for timestamp in timestamps] + [normalized_query(self.request.GET)]
+        user = self.request.user
+        if user.is_authenticated:
+            parts.append(json.dumps({
+                'user': user.pk,
+                'cart': getattr(self, 'cart_summary', None),
+                'notifications': Notification.objects.for_header(user),
+            }, sort_keys=True, default=str))
+            # a header with the user's cart changes without any updated_at moving
+            last_modified = None
+        else:
+            last_modified = int(max(timestamps).timestamp())
+        etag = quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+        return etag, last_modified
+
+
 class OwnershipMixin(object):
     def dispatch(self, request, *args, **kwargs):
         self.request = request
@@ -1,18 +1,24 @@
-from _multiprocessing import send
-
 from django.conf import settings
+from django.core.cache import cache
+from collections import defaultdict
 from datetime import datetime
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.safestring import mark_safe
 import operator
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.safestring import mark_safe
 from django.contrib.auth import get_user_model
 from utils import upload_function
+from .search import search_index
+from .autocomplete import bump_version as bump_autocomplete_version
+from utils.generations import bump as bump_generations, generation
+from utils.page_cache import invalidate_tags, product_tags
+from utils.renditions import rendition_fields, renditions_missing
 
 User = get_user_model()
 
@@ -48,6 +54,7 @@ class Category(models.Model):
     slug = models.SlugField(unique=True, verbose_name='Псевдоним/Slug')
     features = models.ManyToManyField("specs.CategoryFeature", blank=True,
                                       related_name='features_for_category', verbose_name='Характеристика категории')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Категория товара'
@@ -70,6 +77,7 @@ class Brand(models.Model):
     products = models.ManyToManyField('Product', blank=True, related_name='products', verbose_name='Продукты')
     image = models.ImageField(upload_to=upload_function, verbose_name='Маленький логотип')
     big_image = models.ImageField(upload_to=upload_function, blank=True, null=True, verbose_name='Большой логотип')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения')
 
     class Meta:
         verbose_name = 'Торговая марка'
@@ -82,6 +90,20 @@ class Brand(models.Model):
         return reverse('brand_detail', kwargs={'brand_slug': self.slug})
 
 
+class ProductManager(models.Manager):
+    CARD_FIELDS = (
+        'name', 'slug', 'price', 'image', 'out_of_stock', 'category__name', 'category__slug',
+        'brand__name', 'brand__slug', 'brand__country__name', 'volume__name'
+    )
+
+    def cards(self):
+        return self.select_related('brand__country', 'category', 'volume').only(*self.CARD_FIELDS)
+
+    # queryset.update() and bulk_update() skip auto_now, so bulk writers mark the products they changed
+    def touch(self, product_ids):
+        return self.filter(id__in=product_ids).update(updated_at=timezone.now())
+
+
 class Product(models.Model):
     name = models.CharField(max_length=150, verbose_name='Наименование')
     slug = models.SlugField(unique=True, verbose_name='Псевдоним/Slug')
@@ -97,10 +119,17 @@ class Product(models.Model):
     image = models.ImageField(upload_to=upload_function)
     features = models.ManyToManyField("specs.ProductFeatures", blank=True,
                                       related_name='features_for_product', verbose_name='Характеристика товара')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    objects = ProductManager()
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields=['category', 'price']),
+            models.Index(fields=['category', 'out_of_stock']),
+            models.Index(fields=['category', 'updated_at']),
+        ]
 
     def __str__(self):
         return f"{self.name} | {self.volume.name} | {self.category.name}"
@@ -113,6 +142,15 @@ class Product(models.Model):
         return reverse('product_detail', kwargs={'category_slug': self.category.slug, 'brand_slug': self.brand.slug,
                                                  'product_slug': self.slug})
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'stock' in field_names:
+            instance._loaded_stock = instance.stock
+        if 'category_id' in field_names:
+            instance._loaded_category_id = instance.category_id
+        return instance
+
     def get_features(self):
         return {f.feature.feature_name: ' '.join([f.value, f.feature.unit or ""]) for f in self.features.all()}
 
@@ -153,6 +191,7 @@ class CartProduct(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, verbose_name='Товар')
     qty = models.PositiveIntegerField(default=1, verbose_name='Количество')
     final_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Общая стоимость')
 
@@ -175,7 +214,10 @@ class CartProduct(models.Model):
         return f"Продукт: {self.content_object} для корзины"
 
     def save(self, *args, **kwargs):
-        self.final_price = self.qty * self.content_object.price
+        if not self.product_id and ContentType.objects.get_for_id(self.content_type_id).model_class() is Product:
+            self.product_id = self.object_id
+        content_object = self.product if self.product_id else self.content_object
+        self.final_price = self.qty * content_object.price
         super().save(*args, **kwargs)
 
 
@@ -196,6 +238,26 @@ class Cart(models.Model):
     def __str__(self):
         return f"Корзина №{self.id} | Пользователь -  {self.owner}"
 
+    @cached_property
+    def lines(self):
+        lines = list(self.products.select_related('product__brand', 'product__category', 'product__volume'))
+        content_object_field = CartProduct._meta.get_field('content_object')
+        missing = defaultdict(list)
+        for line in lines:
+            if line.product_id:
+                content_object_field.set_cached_value(line, line.product)
+            else:
+                missing[line.content_type_id].append(line)
+        for content_type_id, ct_lines in missing.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            qs = model._default_manager.all()
+            if model is Product:
+                qs = qs.select_related('brand', 'category', 'volume')
+            objects = qs.in_bulk([line.object_id for line in ct_lines])
+            for line in ct_lines:
+                content_object_field.set_cached_value(line, objects.get(line.object_id))
+        return lines
+
 
 class Order(models.Model):
 
@@ -295,6 +357,12 @@ class Address(models.Model):
 
 class NotificationManager(models.Manager):
 
+    # the generation is shared, so notify_many() in run_jobs and make_all_read() in any worker retire
+    # the header every other worker has cached
+    HEADER_CACHE_KEY = 'header-notifications:{user_id}:{generation}'
+    HEADER_GENERATION = 'notifications:{user_id}'
+    HEADER_LIMIT = 5
+
     def get_queryset(self):
         return super().get_queryset()
 
@@ -304,9 +372,40 @@ class NotificationManager(models.Manager):
             read=False
         )
 
+    def for_header(self, user):
+        key = self.HEADER_CACHE_KEY.format(
+            user_id=user.pk, generation=generation(self.HEADER_GENERATION.format(user_id=user.pk))
+        )
+        header = cache.get(key)
+        if header is None:
+            qs = self.get_queryset().filter(recipient__user_id=user.pk, read=False)
+            latest = list(qs.order_by('-id').values('id', 'text')[:self.HEADER_LIMIT])
+            unread = len(latest) if len(latest) < self.HEADER_LIMIT else qs.count()
+            header = {'unread': unread, 'latest': latest}
+            cache.set(key, header)
+        return header
+
+    def invalidate_header(self, recipient_ids):
+        user_ids = Customer.objects.filter(id__in=recipient_ids).values_list('user_id', flat=True)
+        bump_generations(*[self.HEADER_GENERATION.format(user_id=user_id) for user_id in user_ids])
+
+    def create(self, **kwargs):
+        notification = super().create(**kwargs)
+        self.invalidate_header([notification.recipient_id])
+        return notification
+
+    def notify_many(self, recipient_ids, text):
+        notifications = self.bulk_create(
+            [self.model(recipient_id=recipient_id, text=text) for recipient_id in recipient_ids],
+            batch_size=500
+        )
+        self.invalidate_header(recipient_ids)
+        return notifications
+
     def make_all_read(self, recipient):
         qs = self.get_queryset().filter(recipient=recipient, read=False)
         qs.update(read=True)
+        bump_generations(self.HEADER_GENERATION.format(user_id=recipient.user_id))
 
 
 class Notification(models.Model):
@@ -377,42 +476,198 @@ class Review(models.Model):
         return f"Отзыв к {self.product} {self.user} {self.date}"
 
 
-def check_previous_qty(instance, **kwargs):
+class BackgroundJobManager(models.Manager):
+
+    def enqueue(self, name, **payload):
+        return self.create(name=name, payload=payload)
+
+    def pending(self):
+        return self.get_queryset().filter(
+            status=BackgroundJob.STATUS_PENDING, run_after__lte=timezone.now()
+        ).order_by('run_after', 'id')
+
+    # 'running' jobs whose worker stopped before finishing them
+    def stale(self, timeout):
+        return self.get_queryset().filter(
+            status=BackgroundJob.STATUS_RUNNING, locked_at__lt=timezone.now() - timeout
+        )
+
+
+class BackgroundJob(models.Model):
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнена'),
+        (STATUS_FAILED, 'Ошибка')
+    )
+
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    payload = models.JSONField(default=dict, blank=True, verbose_name='Параметры')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True,
+                              verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    error = models.TextField(blank=True, null=True, verbose_name='Ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    processed_at = models.DateTimeField(blank=True, null=True, verbose_name='Обработана')
+    run_after = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Не раньше')
+    locked_at = models.DateTimeField(blank=True, null=True, verbose_name='Взята в работу')
+    objects = BackgroundJobManager()
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f"{self.name} | {self.get_status_display()} | {self.id}"
+
+
+class ProfileRecord(models.Model):
+    label = models.CharField(max_length=100, blank=True, verbose_name='Метка')
+    path = models.CharField(max_length=500, verbose_name='Адрес')
+    view_name = models.CharField(max_length=100, blank=True, db_index=True, verbose_name='Представление')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Пользователь')
+    status_code = models.PositiveSmallIntegerField(verbose_name='Код ответа')
+    duration_ms = models.FloatField(verbose_name='Время, мс')
+    samples = models.PositiveIntegerField(verbose_name='Сэмплов')
+    query_count = models.PositiveIntegerField(verbose_name='Запросов к БД')
+    collapsed_stacks = models.TextField(blank=True, verbose_name='Стеки (collapsed)')
+    sql_log = models.JSONField(default=list, blank=True, verbose_name='SQL запросы')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
 
-    try:
-        product = Product.objects.get(id=instance.id)
-    except Product.DoesNotExist:
+    class Meta:
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f"{self.view_name or self.path} | {self.duration_ms} мс | {self.created_at:%d.%m.%Y %H:%M}"
+
+
+class Generation(models.Model):
+    namespace = models.CharField(max_length=100, unique=True, verbose_name='Пространство имен')
+    value = models.BigIntegerField(default=0, verbose_name='Поколение')
+
+    class Meta:
+        verbose_name = 'Поколение кэша'
+        verbose_name_plural = 'Поколения кэшей'
+
+    def __str__(self):
+        return f"{self.namespace} | {self.value}"
+
+
+def check_previous_qty(instance, **kwargs):
+    if not instance.pk:
         return None
-    instance.out_of_stock = True if not product.stock else False
+    previous_stock = getattr(instance, '_loaded_stock', None)
+    if previous_stock is None:
+        previous_stock = Product.objects.filter(id=instance.id).values_list('stock', flat=True).first()
+        if previous_stock is None:
+            return None
+    instance.out_of_stock = True if not previous_stock else False
 
 
 def send_notification(instance, **kwargs):
+    instance._loaded_stock = instance.stock
     if instance.stock and instance.out_of_stock:
-        customers = Customer.objects.filter(
-            wishlist__in=[instance]
-        )
-        if customers.count():
-            for c in customers:
-                Notification.objects.create(
-                    recipient=c,
-                    text=mark_safe(f'Товар, <a href="{instance.get_absolute_url()}">{instance.name}</a>, '
-                                   f'который вы ожидаете, есть в наличии')
-                )
-                c.wishlist.remove(instance)
+        BackgroundJob.objects.enqueue('restock_notifications', product_id=instance.id)
 
 
-post_save.connect(send_notification, sender=Product)
-pre_save.connect(check_previous_qty, sender=Product)
+def enqueue_renditions(instance, **kwargs):
+    for field, presets in rendition_fields(instance).items():
+        field_file = getattr(instance, field)
+        if field_file and renditions_missing(field_file, presets):
+            BackgroundJob.objects.enqueue(
+                'generate_renditions', model=instance._meta.label_lower, pk=instance.pk, field=field
+            )
+
+
+def index_product(instance, **kwargs):
+    search_index.index_products([instance.id])
+
+
+def remove_product_from_index(instance, **kwargs):
+    search_index.remove_products([instance.id])
+
+
+def index_brand_products(instance, **kwargs):
+    search_index.index_brand(instance.id)
 
 
+def index_category_products(instance, **kwargs):
+    search_index.index_category(instance.id)
 
 
+def refresh_autocomplete(**kwargs):
+    bump_autocomplete_version()
 
 
+def invalidate_product_pages(instance, **kwargs):
+    tags = product_tags(instance.id, instance.category_id, instance.brand_id)
+    loaded_category_id = getattr(instance, '_loaded_category_id', instance.category_id)
+    if loaded_category_id != instance.category_id:
+        tags.append(f"category:{loaded_category_id}")
+    invalidate_tags('products', *tags)
 
 
+# a removed or moved product does not raise the newest updated_at of the category it left
+def touch_left_category(instance, **kwargs):
+    if 'created' in kwargs:
+        category_id = getattr(instance, '_loaded_category_id', instance.category_id)
+        if category_id == instance.category_id:
+            return
+    else:
+        category_id = instance.category_id
+    Category.objects.filter(id=category_id).update(updated_at=timezone.now())
 
 
+def invalidate_brand_pages(instance, **kwargs):
+    invalidate_tags('brands', f"brand:{instance.id}")
 
 
+def invalidate_category_pages(instance, **kwargs):
+    invalidate_tags('categories', f"category:{instance.id}")
 
+
+def invalidate_slider_pages(**kwargs):
+    invalidate_tags('sliders')
+
+
+def invalidate_banner_pages(**kwargs):
+    invalidate_tags('banners')
+
+
+post_save.connect(send_notification, sender=Product)
+pre_save.connect(check_previous_qty, sender=Product)
+post_save.connect(enqueue_renditions, sender=Product)
+post_save.connect(enqueue_renditions, sender=Brand)
+post_save.connect(enqueue_renditions, sender=Slider)
+post_save.connect(enqueue_renditions, sender=Baner)
+post_save.connect(enqueue_renditions, sender=ImageGallery)
+post_save.connect(index_product, sender=Product)
+post_delete.connect(remove_product_from_index, sender=Product)
+post_save.connect(index_brand_products, sender=Brand)
+post_save.connect(index_category_products, sender=Category)
+post_save.connect(refresh_autocomplete, sender=Product)
+post_delete.connect(refresh_autocomplete, sender=Product)
+post_save.connect(refresh_autocomplete, sender=Brand)
+post_delete.connect(refresh_autocomplete, sender=Brand)
+post_save.connect(refresh_autocomplete, sender=Category)
+post_delete.connect(refresh_autocomplete, sender=Category)
+post_save.connect(invalidate_product_pages, sender=Product)
+post_delete.connect(invalidate_product_pages, sender=Product)
+post_save.connect(touch_left_category, sender=Product)
+post_delete.connect(touch_left_category, sender=Product)
+post_save.connect(invalidate_brand_pages, sender=Brand)
+post_delete.connect(invalidate_brand_pages, sender=Brand)
+post_save.connect(invalidate_category_pages, sender=Category)
+post_delete.connect(invalidate_category_pages, sender=Category)
+post_save.connect(invalidate_slider_pages, sender=Slider)
+post_delete.connect(invalidate_slider_pages, sender=Slider)
+post_save.connect(invalidate_banner_pages, sender=Baner)
+post_delete.connect(invalidate_banner_pages, sender=Baner)
@@ -0,0 +1,70 @@
+import math
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, IntegerField, Max, Min
+from django.db.models.functions import Cast, Floor
+
+from utils.generations import generation
+
+PRICE_HISTOGRAM_CACHE_KEY = 'price-histogram:{category_id}:{generation}'
+# product, brand and category saves bump the shared 'catalog' generation (see refresh_autocomplete)
+PRICE_HISTOGRAM_GENERATION = 'catalog'
+PRICE_HISTOGRAM_CACHE_TIMEOUT = 60 * 60
+PRICE_HISTOGRAM_BUCKETS = 12
+
+
+def get_price_histogram(category_id):
+    key = PRICE_HISTOGRAM_CACHE_KEY.format(category_id=category_id, generation=generation(PRICE_HISTOGRAM_GENERATION))
+    histogram = cache.get(key)
+    if histogram is None:
+        histogram = build_price_histogram(category_id)
+        cache.set(key, histogram, PRICE_HISTOGRAM_CACHE_TIMEOUT)
+    return histogram
+
+
+# min/max and the bucket counts are both read from the (category, price) index
+def build_price_histogram(category_id, buckets=PRICE_HISTOGRAM_BUCKETS):
+    from .models import Product
+
+    products = Product.objects.filter(category_id=category_id)
+    bounds = products.aggregate(min=Min('price'), max=Max('price'))
+    low, high = bounds['min'], bounds['max']
+    if low is None:
+        return {'min': None, 'max': None, 'floor': None, 'ceiling': None, 'buckets': []}
+    width = (high - low) / buckets or Decimal(1)
+    # Floor first: casting a decimal to an integer truncates on SQLite but rounds on PostgreSQL
+    bucket = Cast(
+        Floor(ExpressionWrapper((F('price') - low) / width, output_field=DecimalField())), IntegerField()
+    )
+    counts = [0] * buckets
+    rows = products.order_by().annotate(bucket=bucket).values('bucket').annotate(products=Count('pk'))
+    for row in rows:
+        counts[min(max(row['bucket'], 0), buckets - 1)] += row['products']
+    tallest = max(counts) or 1
+    return {
+        'min': low,
+        'max': high,
+        'floor': math.floor(low),
+        'ceiling': math.ceil(high),
+        'buckets': [
+            {
+                'from': low + width * position,
+                'to': low + width * (position + 1),
+                'products': products_count,
+                'height': round(products_count * 100 / tallest)
+            }
+            for position, products_count in enumerate(counts)
+        ]
+    }
+
+
+def price_range_from_query(query_dict):
+    price_range = []
+    for key in ('price_min', 'price_max'):
+        try:
+            value = Decimal(query_dict.get(key, ''))
+        except InvalidOperation:
+            value = None
+        price_range.append(value if value is not None and value.is_finite() else None)
+    return price_range
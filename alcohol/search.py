@@ -0,0 +1,218 @@
+import re
+
+import snowballstemmer
+from django.db import connection
+from django.db.models import Case, IntegerField, When
+
+BATCH_SIZE = 500
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+russian_stemmer = snowballstemmer.stemmer('russian')
+english_stemmer = snowballstemmer.stemmer('english')
+
+
+def tokenize(text):
+    return WORD_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def stem(word):
+    if CYRILLIC_RE.search(word):
+        return russian_stemmer.stemWord(word)
+    return english_stemmer.stemWord(word)
+
+
+def stemmed_text(text):
+    words = []
+    for word in tokenize(text):
+        words.append(word)
+        stemmed = stem(word)
+        if stemmed != word:
+            words.append(stemmed)
+    return ' '.join(words)
+
+
+def product_documents(product_ids=None):
+    from .models import Product
+    from specs.models import ProductFeatures
+
+    products = Product.objects.select_related('brand__country', 'category').only(
+        'id', 'name', 'description', 'brand__name', 'brand__country__name', 'category__name'
+    )
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+    features = {}
+    feature_rows = ProductFeatures.objects.values_list('product_id', 'value')
+    if product_ids is not None:
+        feature_rows = feature_rows.filter(product_id__in=product_ids)
+    for product_id, value in feature_rows:
+        features.setdefault(product_id, []).append(value)
+    for product in products.iterator():
+        brand = product.brand
+        yield product.id, {
+            'name': product.name,
+            'brand': ' '.join([brand.name, brand.country.name, product.category.name] if brand else
+                              [product.category.name]),
+            'body': ' '.join([product.description or ''] + features.get(product.id, []))
+        }
+
+
+class SQLiteSearchBackend:
+    table = 'alcohol_product_fts'
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"product_id UNINDEXED, name, brand, body, tokenize='unicode61 remove_diacritics 2')"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index(self, cursor, documents):
+        rows = [
+            (product_id, stemmed_text(document['name']), stemmed_text(document['brand']),
+             stemmed_text(document['body']))
+            for product_id, document in documents
+        ]
+        self.remove(cursor, [row[0] for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {self.table} (product_id, name, brand, body) VALUES (%s, %s, %s, %s)", rows
+        )
+
+    def remove(self, cursor, product_ids):
+        product_ids = list(product_ids)
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            batch = product_ids[start:start + BATCH_SIZE]
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE product_id IN ({', '.join(['%s'] * len(batch))})", batch
+            )
+
+    def count(self, cursor):
+        cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+        return cursor.fetchone()[0]
+
+    def search(self, cursor, query, limit):
+        terms = [f'"{stem(word)}"*' for word in tokenize(query)]
+        if not terms:
+            return []
+        cursor.execute(
+            f"SELECT product_id FROM {self.table} WHERE {self.table} MATCH %s "
+            f"ORDER BY bm25({self.table}, 0, 10.0, 4.0, 1.0) LIMIT %s",
+            [' AND '.join(terms), limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    table = 'alcohol_product_search'
+    document_sql = (
+        "setweight(to_tsvector('russian', %s), 'A') || "
+        "setweight(to_tsvector('russian', %s), 'B') || "
+        "setweight(to_tsvector('russian', %s), 'C')"
+    )
+
+    def create(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            f"product_id bigint PRIMARY KEY REFERENCES alcohol_product (id) ON DELETE CASCADE "
+            f"DEFERRABLE INITIALLY DEFERRED, document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_document_idx ON {self.table} USING GIN (document)"
+        )
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def index(self, cursor, documents):
+        cursor.executemany(
+            f"INSERT INTO {self.table} (product_id, document) VALUES (%s, {self.document_sql}) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            [(product_id, document['name'], document['brand'], document['body'])
+             for product_id, document in documents]
+        )
+
+    def remove(self, cursor, product_ids):
+        cursor.execute(f"DELETE FROM {self.table} WHERE product_id = ANY(%s)", [list(product_ids)])
+
+    def count(self, cursor):
+        cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+        return cursor.fetchone()[0]
+
+    def search(self, cursor, query, limit):
+        terms = [f"{word}:*" for word in tokenize(query)]
+        if not terms:
+            return []
+        cursor.execute(
+            f"SELECT product_id FROM {self.table}, to_tsquery('russian', %s) query "
+            f"WHERE document @@ query ORDER BY ts_rank(document, query) DESC LIMIT %s",
+            [' & '.join(terms), limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+SEARCH_BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    backend = SEARCH_BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+class SearchIndex:
+
+    def index_products(self, product_ids):
+        backend = get_backend()
+        if backend and product_ids:
+            with connection.cursor() as cursor:
+                backend.index(cursor, product_documents(product_ids))
+
+    def index_brand(self, brand_id):
+        from .models import Product
+
+        self.index_products(list(Product.objects.filter(brand_id=brand_id).values_list('id', flat=True)))
+
+    def index_category(self, category_id):
+        from .models import Product
+
+        self.index_products(list(Product.objects.filter(category_id=category_id).values_list('id', flat=True)))
+
+    def remove_products(self, product_ids):
+        backend = get_backend()
+        if backend and product_ids:
+            with connection.cursor() as cursor:
+                backend.remove(cursor, product_ids)
+
+    def rebuild(self):
+        backend = get_backend()
+        if backend:
+            with connection.cursor() as cursor:
+                backend.drop(cursor)
+                backend.create(cursor)
+                backend.index(cursor, product_documents())
+
+    def is_empty(self):
+        backend = get_backend()
+        if not backend:
+            return False
+        with connection.cursor() as cursor:
+            return not backend.count(cursor)
+
+    def filter(self, queryset, query, limit=500):
+        backend = get_backend()
+        if not backend:
+            return queryset.filter(name__icontains=query)
+        with connection.cursor() as cursor:
+            product_ids = backend.search(cursor, query, limit)
+        if not product_ids:
+            return queryset.none()
+        ranking = Case(*[When(id=product_id, then=position) for position, product_id in enumerate(product_ids)],
+                       output_field=IntegerField())
+        return queryset.filter(id__in=product_ids).order_by(ranking)
+
+
+search_index = SearchIndex()
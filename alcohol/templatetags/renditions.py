@@ -0,0 +1,52 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from utils.renditions import RENDITION_DENSITIES, rendition_name
+
+register = template.Library()
+
+_existing_renditions = set()
+
+
+def _exists(storage, name):
+    if name in _existing_renditions:
+        return True
+    if storage.exists(name):
+        _existing_renditions.add(name)
+        return True
+    return False
+
+
+def _srcset(field_file, preset, extension):
+    return ', '.join(
+        f"{field_file.storage.url(rendition_name(field_file.name, preset, density, extension))} {density}x"
+        for density in RENDITION_DENSITIES
+    )
+
+
+@register.simple_tag
+def rendition_url(field_file, preset, extension='jpg'):
+    if not field_file:
+        return ''
+    name = rendition_name(field_file.name, preset, extension=extension)
+    if _exists(field_file.storage, name):
+        return field_file.storage.url(name)
+    return field_file.url
+
+
+@register.simple_tag
+def picture(field_file, preset, **attrs):
+    if not field_file:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    storage = field_file.storage
+    if not _exists(storage, rendition_name(field_file.name, preset)):
+        return format_html('<img src="{}"{}>', field_file.url, flatatt(attrs))
+    source = ''
+    if _exists(storage, rendition_name(field_file.name, preset, extension='webp')):
+        source = format_html('<source type="image/webp" srcset="{}">', _srcset(field_file, preset, 'webp'))
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}"{}></picture>',
+        source, rendition_url(field_file, preset), _srcset(field_file, preset, 'jpg'), flatatt(attrs)
+    )
@@ -1,37 +1,36 @@
-from collections import defaultdict
-
 from django import template
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
 
-from specs.models import ProductFeatures
+from specs.facets import get_facet_sidebar
 
 register = template.Library()
 
 
-@register.filter
-def product_spec(category):
-    product_features = ProductFeatures.objects.filter(product__category=category)
-    feature_and_values = defaultdict(list)
-    for product_feature in product_features:
-        if product_feature.value not in feature_and_values[(product_feature.feature.feature_name, product_feature.feature.feature_filter_name)]:
-            feature_and_values[
-                (product_feature.feature.feature_name, product_feature.feature.feature_filter_name)
-            ].append(product_feature.value)
-    print(feature_and_values)
-    search_filter_body = """<div>{}</div>"""
-    mid_res = ""
-    for (feature_name, feature_filter_name), feature_values in feature_and_values.items():
-        feature_name_html = f"""<h6 class='text-uppercase mb-3'>{feature_name}</h6>"""
-        feature_values_res = ""
-        for f_v in feature_values:
-            mid_feature_values_res = \
-                "<input class='form-check-input' type='checkbox' name='{f_f_name}' value='{feature_name}'> {feature_name}</br>".format(
-                    feature_name=f_v, f_f_name=feature_filter_name
-
-                )
-            feature_values_res += mid_feature_values_res
-        feature_name_html += feature_values_res
-        mid_res += feature_name_html + '<hr>'
-    res = search_filter_body.format(mid_res)
-    return mark_safe(res)
-
+@register.simple_tag(takes_context=True)
+def product_spec(context, category):
+    query = context['request'].GET
+    mid_res = []
+    for facet in get_facet_sidebar(category.id):
+        feature_name_html = format_html("<h6 class='text-uppercase mb-3'>{}</h6>", facet['feature_name'])
+        if facet['numeric']:
+            feature_values_res = format_html(
+                "<div class='d-flex gap-2'>"
+                "<input class='form-control form-control-sm rounded-0' type='number' step='any' name='{}_min' "
+                "placeholder='от {} {}' value='{}'>"
+                "<input class='form-control form-control-sm rounded-0' type='number' step='any' name='{}_max' "
+                "placeholder='до {} {}' value='{}'>"
+                "</div>",
+                facet['filter_name'], facet['min'], facet['unit'], query.get(f"{facet['filter_name']}_min", ''),
+                facet['filter_name'], facet['max'], facet['unit'], query.get(f"{facet['filter_name']}_max", '')
+            )
+        else:
+            selected = set(query.getlist(facet['filter_name']))
+            feature_values_res = format_html_join(
+                '',
+                "<input class='form-check-input' type='checkbox' name='{}' value='{}'{}> {} ({})</br>",
+                ((facet['filter_name'], value, mark_safe(' checked') if value in selected else '', value, products)
+                 for value, products in facet['values'])
+            )
+        mid_res.append(feature_name_html + feature_values_res + '<hr>')
+    return format_html('<div>{}</div>', mark_safe(''.join(mid_res)))
@@ -1,3 +1,550 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .autocomplete import AUTOCOMPLETE_VERSION_CHECK_INTERVAL, autocomplete_index
+from .models import BackgroundJob, Cart, Category, Notification, Order, Product, User
+from .prices import get_price_histogram
+from specs.facets import facet_index
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+from spirits.query_budgets import QUERY_BUDGETS
+from utils.generations import DatabaseGenerationStore, GenerationSnapshot, check_generation_store, get_store
+from utils.jobs import JOB_HANDLERS, LOCK_TIMEOUT, MAX_ATTEMPTS, register_job, run_pending
+from utils.pagination import encode_cursor
+from utils.recalc_cart import recalc_cart
+from utils.seed import SEED_PASSWORD, seed_catalog
+
+
+# the settings budgets cover single cold requests by url name; these tighter limits are for repeated,
+# cached and filtered requests that only the tests make
+QUERY_LIMITS = {
+    **QUERY_BUDGETS,
+    'index_warm': 5,
+    'page_cache_hit': 1,
+    'not_modified': 4,
+    'category_detail_filtered': 10,
+}
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+class QueryCountMixin:
+    products = None
+    cart_lines = None
+    orders_per_customer = None
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog = seed_catalog(products=cls.products, categories=2, brands=5, customers=2,
+                               orders_per_customer=cls.orders_per_customer, cart_lines=cls.cart_lines)
+        cls.category = catalog.categories[0]
+        cls.product = next(product for product in catalog.products if product.category_id == cls.category.id)
+        cls.features = [feature for feature in catalog.features if feature.category_id == cls.category.id]
+        cls.customer = catalog.customers[0]
+        cls.user = cls.customer.user
+        cls.user.is_staff = cls.user.is_superuser = True
+        cls.user.save(update_fields=['is_staff', 'is_superuser'])
+        cls.order = Order.objects.filter(customer=cls.customer).first()
+        Notification.objects.notify_many([cls.customer.id] * cls.orders_per_customer, 'Товар снова в наличии')
+
+    def setUp(self):
+        cache.clear()
+        facet_index.invalidate()
+        autocomplete_index.load()
+        self.client.force_login(self.user)
+
+    def assertMaxQueries(self, name, method, url, data=None, **extra):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = getattr(self.client, method)(url, data, **extra)
+        self.assertLess(response.status_code, 400, f'{name}: {url} returned {response.status_code}')
+        limit = QUERY_LIMITS[name]
+        self.assertLessEqual(
+            len(counter.queries), limit,
+            f'{name}: {len(counter.queries)} queries, limit {limit}\n' + '\n'.join(counter.queries)
+        )
+        return response
+
+    @property
+    def product_url(self):
+        return self.product.get_absolute_url()
+
+    @property
+    def cart_kwargs(self):
+        return {'ct_model': 'product', 'slug': self.product.slug}
+
+    def add_product_to_cart(self):
+        self.client.get(reverse('add_to_cart', kwargs=self.cart_kwargs), HTTP_REFERER='/')
+
+    def test_catalog_pages(self):
+        self.assertMaxQueries('index', 'get', reverse('index'))
+        self.assertMaxQueries('categories', 'get', reverse('categories'))
+        self.assertMaxQueries('brands', 'get', reverse('brands'))
+        category_url = reverse('category_detail', kwargs={'category_slug': self.category.slug})
+        self.assertMaxQueries('category_detail', 'get', category_url)
+        self.assertMaxQueries('category_detail_filtered', 'get', category_url, {
+            'region': ['Коньяк', 'Айла'], 'strength_min': '30', 'price_max': '25000', 'in_stock': '1',
+            'sort': 'price'
+        })
+        self.assertMaxQueries('product_detail', 'get', self.product_url)
+        self.assertMaxQueries('quick_view', 'get', reverse('quick_view', kwargs={'pk': self.product.pk}))
+        self.assertMaxQueries('search', 'get', reverse('search'), {'search': 'товар'})
+        self.assertMaxQueries('autocomplete', 'get', reverse('autocomplete'), {'q': 'тов'})
+
+    def test_malformed_cursor_shows_first_page(self):
+        category_url = reverse('category_detail', kwargs={'category_slug': self.category.slug})
+        for url in (category_url, reverse('categories')):
+            first_page = list(self.client.get(url, {'sort': 'price'}).context['page'])
+            for sort, cursor in (('default', ['x']), ('price', ['abc', 1]), ('default', [{'a': 1}]),
+                                 ('price', [None, 1]), ('price', [1])):
+                response = self.client.get(url, {'sort': sort, 'after': encode_cursor(cursor)})
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.context['page'].has_previous)
+            response = self.client.get(url, {'sort': 'price', 'before': encode_cursor(['abc', 1])})
+            self.assertEqual(list(response.context['page']), first_page)
+
+    def test_warm_fragments(self):
+        self.client.get(reverse('index'))
+        self.assertMaxQueries('index_warm', 'get', reverse('index'))
+
+    def test_fragments_follow_other_workers(self):
+        self.client.get(reverse('index'))
+        Category.objects.create(name='Кальвадос', slug='calvados')
+        self.assertNotContains(self.client.get(reverse('index')), 'Кальвадос')
+        get_store().bump(['page-categories'])
+        self.assertContains(self.client.get(reverse('index')), 'Кальвадос')
+
+    def test_auth_pages(self):
+        self.assertMaxQueries('registration', 'get', reverse('registration'))
+        self.assertMaxQueries('account', 'get', reverse('account'))
+        self.assertMaxQueries('instrumentation_report', 'get', reverse('instrumentation_report'))
+        self.assertMaxQueries('clear-notifications', 'get', reverse('clear-notifications'), HTTP_REFERER='/')
+        self.assertMaxQueries('logout', 'get', reverse('logout'))
+        self.assertMaxQueries('login', 'get', reverse('login'))
+
+    def test_anonymous_page_cache(self):
+        self.client.logout()
+        for url in (reverse('index'), reverse('categories'), reverse('brands'), self.product_url,
+                    reverse('category_detail', kwargs={'category_slug': self.category.slug})):
+            self.client.get(url)
+            self.assertMaxQueries('page_cache_hit', 'get', url)
+
+    def test_page_cache_follows_other_workers(self):
+        self.client.logout()
+        url = reverse('categories')
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        # a write in another process only reaches this one through the shared counter
+        get_store().bump(['page-categories'])
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'miss')
+
+    def test_header_notifications_follow_other_workers(self):
+        unread = Notification.objects.for_header(self.user)['unread']
+        Notification.objects.bulk_create([Notification(recipient=self.customer, text='Новое поступление')])
+        self.assertEqual(Notification.objects.for_header(self.user)['unread'], unread)
+        # notify_many() in run_jobs
+        get_store().bump([f'notifications:{self.user.pk}'])
+        self.assertEqual(Notification.objects.for_header(self.user)['unread'], unread + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.make_all_read(self.customer)
+        self.assertEqual(Notification.objects.for_header(self.user), {'unread': 0, 'latest': []})
+
+    def test_price_histogram_follows_catalog_generation(self):
+        products = Product.objects.filter(category=self.category)
+        histogram = get_price_histogram(self.category.id)
+        self.assertEqual(sum(bucket['products'] for bucket in histogram['buckets']), products.count())
+        products.filter(pk=self.product.pk).update(price=histogram['max'] + 1000)
+        self.assertEqual(get_price_histogram(self.category.id), histogram)
+        get_store().bump(['catalog'])
+        histogram = get_price_histogram(self.category.id)
+        self.assertEqual(histogram['max'], products.get(pk=self.product.pk).price)
+        self.assertGreaterEqual(histogram['buckets'][-1]['products'], 1)
+        self.assertEqual(sum(bucket['products'] for bucket in histogram['buckets']), products.count())
+
+    def test_conditional_get(self):
+        category_url = reverse('category_detail', kwargs={'category_slug': self.category.slug})
+        for url in (self.product_url, category_url):
+            etag = self.client.get(url)['ETag']
+            response = self.assertMaxQueries('not_modified', 'get', url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        self.product.features.first().save()
+        for url in (self.product_url, category_url):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.logout()
+        last_modified = self.client.get(self.product_url)['Last-Modified']
+        response = self.assertMaxQueries('not_modified', 'get', self.product_url,
+                                         HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_wishlist(self):
+        kwargs = {'product_id': self.product.pk}
+        self.assertMaxQueries('add_to_wishlist', 'get', reverse('add_to_wishlist', kwargs=kwargs), HTTP_REFERER='/')
+        self.assertMaxQueries('remove_from_wishlist', 'get', reverse('remove_from_wishlist', kwargs=kwargs),
+                              HTTP_REFERER='/')
+
+    def test_cart(self):
+        self.assertMaxQueries('cart', 'get', reverse('cart'))
+        self.assertMaxQueries('header_fragment', 'get', reverse('header_fragment'))
+        self.assertMaxQueries('add_to_cart', 'get', reverse('add_to_cart', kwargs=self.cart_kwargs),
+                              HTTP_REFERER='/')
+        self.assertMaxQueries('change_qty', 'post', reverse('change_qty', kwargs=self.cart_kwargs), {'qty': 3},
+                              HTTP_REFERER='/')
+        self.assertMaxQueries('delete_from_cart', 'get', reverse('delete_from_cart', kwargs=self.cart_kwargs),
+                              HTTP_REFERER='/')
+
+    def test_checkout(self):
+        self.add_product_to_cart()
+        self.assertMaxQueries('checkout', 'get', reverse('checkout'))
+        self.assertMaxQueries('make_order', 'post', reverse('make_order'), {
+            'first_name': 'Покупатель', 'last_name': 'Тестовый', 'phone': self.customer.phone,
+            'address': self.customer.addresses.first().id, 'buying_type': 'Доставка', 'comment': ''
+        })
+        self.assertMaxQueries('checkout-complete', 'get', reverse('checkout-complete'))
+        self.assertMaxQueries('order-detail', 'get', reverse('order-detail', kwargs={'pk': self.order.pk}))
+
+    def test_login_post(self):
+        self.client.logout()
+        self.assertMaxQueries('login', 'post', reverse('login'),
+                              {'username': self.user.username, 'password': SEED_PASSWORD})
+
+    def test_specs_pages(self):
+        for name in ('product-list-for-features', 'new-feature', 'new-category', 'new-validator',
+                     'new-product-feature', 'update-product-features'):
+            self.assertMaxQueries(name, 'get', reverse(name))
+
+    def test_specs_ajax(self):
+        feature = self.features[-1]
+        self.assertMaxQueries('feature-choice-validators', 'get', reverse('feature-choice-validators'),
+                              {'category_id': self.category.id})
+        self.assertMaxQueries('create-feature', 'get', reverse('create-feature'), {
+            'category_id': self.category.id, 'feature_name': feature.feature_name, 'feature_value': 'Зеленый'
+        })
+        self.assertMaxQueries('search-product', 'get', reverse('search-product'),
+                              {'category_id': self.category.id, 'query': 'товар'})
+        self.assertMaxQueries('attach-feature', 'get', reverse('attach-feature'), {'product_id': self.product.id})
+        self.assertMaxQueries('product-feature', 'get', reverse('product-feature'),
+                              {'category_id': self.category.id, 'product_feature_name': feature.feature_name})
+        self.assertMaxQueries('show-product-features-for-update', 'get',
+                              reverse('show-product-features-for-update'), {'product_id': self.product.id})
+        self.assertMaxQueries('update-product-features-ajax', 'post', reverse('update-product-features-ajax'), {
+            'brand_id': self.product.brand_id, 'category_id': self.category.id,
+            'features_names': [feature.feature_name], 'new_feature_values': ['Зеленый']
+        })
+
+    def test_attach_new_product_feature(self):
+        feature = self.features[-1]
+        self.product.features.filter(feature=feature).delete()
+        self.assertMaxQueries('attach-new-product-feature', 'get', reverse('attach-new-product-feature'), {
+            'product': self.product.name, 'category_feature': feature.feature_name, 'value': 'Белый'
+        })
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class SmallCatalogQueryCountTests(QueryCountMixin, TestCase):
+    products = 10
+    cart_lines = 2
+    orders_per_customer = 1
+
+
+@override_settings(QUERY_BUDGET_ACTION='raise')
+class LargeCatalogQueryCountTests(QueryCountMixin, TestCase):
+    products = 300
+    cart_lines = 25
+    orders_per_customer = 15
+
+
+class CatalogBehaviourTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        catalog = seed_catalog(products=60, categories=2, brands=5, customers=1, orders_per_customer=0,
+                               cart_lines=0)
+        cls.category = catalog.categories[0]
+        cls.products = [product for product in catalog.products if product.category_id == cls.category.id]
+        cls.customer = catalog.customers[0]
+        cls.category_url = reverse('category_detail', kwargs={'category_slug': cls.category.slug})
+
+    def setUp(self):
+        cache.clear()
+        facet_index.invalidate()
+        self.client.force_login(self.customer.user)
+
+    def products_with(self, filter_name, values=None, **numeric):
+        features = ProductFeatures.objects.filter(feature__category=self.category,
+                                                  feature__feature_filter_name=filter_name)
+        if values is not None:
+            features = features.filter(value__in=values)
+        for lookup, bound in numeric.items():
+            features = features.filter(**{f'numeric_value__{lookup}': bound})
+        return set(features.values_list('product_id', flat=True))
+
+    def category_product_ids(self, params):
+        page = self.client.get(self.category_url, {**params, 'per_page': 100}).context['page']
+        return {product.id for product in page}
+
+    def test_facet_values_unite_and_features_intersect(self):
+        regions = self.category_product_ids({'region': ['Коньяк', 'Айла']})
+        self.assertTrue(regions)
+        self.assertEqual(regions,
+                         self.products_with('region', ['Коньяк']) | self.products_with('region', ['Айла']))
+        expected = regions & self.products_with('color', ['Белый', 'Янтарный'])
+        self.assertTrue(expected)
+        selected = {'region': ['Коньяк', 'Айла'], 'color': ['Белый', 'Янтарный']}
+        self.assertEqual(self.category_product_ids(selected), expected)
+
+    def walk_category(self, params):
+        params = {**params, 'per_page': 9}
+        found = []
+        while True:
+            page = self.client.get(self.category_url, params).context['page']
+            found.extend(product.id for product in page)
+            if not page.has_next:
+                return found
+            params['after'] = page.next_cursor
+
+    def test_facet_matches_never_reach_sql_as_a_long_id_list(self):
+        selected = {'region': ['Коньяк', 'Айла', 'Тоскана'], 'in_stock': '1'}
+        expected = self.products_with('region', selected['region']) & set(
+            Product.objects.filter(category=self.category, out_of_stock=False).values_list('id', flat=True)
+        )
+        self.assertGreater(len(expected), 10)
+        prices = dict(Product.objects.values_list('id', 'price'))
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            self.assertEqual(self.walk_category(selected), sorted(expected))
+            self.assertEqual(self.walk_category({**selected, 'sort': 'newest'}), sorted(expected, reverse=True))
+        self.assertLessEqual(max(sql.count('%s') for sql in counter.queries), 9 + 1 + 5)
+        by_price = sorted(expected, key=lambda pk: (prices[pk], pk))
+        self.assertEqual(self.walk_category({**selected, 'sort': 'price'}), by_price)
+        with override_settings(FACET_ID_LIST_LIMIT=10):
+            self.assertEqual(self.walk_category({**selected, 'sort': 'price'}), by_price)
+
+    def test_facet_index_follows_committed_writes_only(self):
+        facets = facet_index.get(self.category.id)
+        product_feature = ProductFeatures.objects.filter(feature__category=self.category,
+                                                         feature__feature_filter_name='region').first()
+        product_feature.value = 'Тоскана'
+        with self.captureOnCommitCallbacks(execute=True):
+            product_feature.save()
+        # the writing worker applies its own change instead of reloading the category
+        self.assertIs(facet_index.get(self.category.id), facets)
+        self.assertIn(product_feature.product_id,
+                      facet_index.filter_product_ids(self.category.id, {'region': ['Тоскана']}))
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValueError):
+            with transaction.atomic():
+                product_feature.value = 'ROLLEDBACK'
+                product_feature.save()
+                raise ValueError
+        self.assertFalse(facet_index.filter_product_ids(self.category.id, {'region': ['ROLLEDBACK']}))
+        self.assertIn(product_feature.product_id,
+                      facet_index.filter_product_ids(self.category.id, {'region': ['Тоскана']}))
+
+    def test_numeric_range_filters(self):
+        strength = self.products_with('strength', gte=Decimal('37.5'), lte=Decimal('43'))
+        self.assertTrue(strength)
+        self.assertEqual(self.category_product_ids({'strength_min': '37.5', 'strength_max': '43'}), strength)
+        expected = strength & self.products_with('age', gte=8)
+        self.assertTrue(expected)
+        self.assertEqual(
+            self.category_product_ids({'strength_min': '37.5', 'strength_max': '43', 'age_min': '8'}), expected
+        )
+
+    def test_cursor_pages_have_no_duplicates_or_gaps(self):
+        expected = [product.id for product in sorted(self.products, key=lambda product: (product.price, product.id))]
+        params = {'sort': 'price', 'per_page': 9}
+        pages = []
+        while True:
+            page = self.client.get(self.category_url, params).context['page']
+            pages.append([product.id for product in page])
+            if not page.has_next:
+                break
+            params['after'] = page.next_cursor
+        self.assertEqual(sum(pages, []), expected)
+        # and back from the last page through the "before" cursors
+        params.pop('after')
+        backwards = [pages[-1]]
+        while page.has_previous:
+            params['before'] = page.previous_cursor
+            page = self.client.get(self.category_url, params).context['page']
+            backwards.insert(0, [product.id for product in page])
+        self.assertEqual(backwards, pages)
+
+    def test_string_feature_with_validators_rejects_other_values(self):
+        feature = CategoryFeature.objects.create(category=self.category, feature_name='Выдержка бочки',
+                                                 feature_filter_name='cask')
+        FeatureValidator.objects.create(category=self.category, feature_key=feature, valid_feature_value='Дуб')
+        product_feature = ProductFeatures.objects.create(product=self.products[0], feature=feature, value='Дуб')
+        products = Product.objects.filter(id=self.products[0].id)
+        with self.assertRaises(ValidationError):
+            ProductFeatures.objects.bulk_set_values(products, {'Выдержка бочки': 'любая чепуха'})
+        product_feature.refresh_from_db()
+        self.assertEqual(product_feature.value, 'Дуб')
+        FeatureValidator.objects.create(category=self.category, feature_key=feature, valid_feature_value='Херес')
+        ProductFeatures.objects.bulk_set_values(products, {'Выдержка бочки': 'Херес'})
+        product_feature.refresh_from_db()
+        self.assertEqual(product_feature.value, 'Херес')
+
+    def test_registry_etag_is_the_same_on_every_worker(self):
+        url = reverse('feature-choice-validators')
+        etag = self.client.get(url, {'category_id': self.category.id})['ETag']
+        cache.clear()
+        self.assertEqual(self.client.get(url, {'category_id': self.category.id})['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            FeatureValidator.objects.create(
+                category=self.category, feature_key=CategoryFeature.objects.filter(category=self.category).first(),
+                valid_feature_value='Новое значение'
+            )
+        self.assertNotEqual(self.client.get(url, {'category_id': self.category.id})['ETag'], etag)
+
+    def search_ids(self, query):
+        return {product.id for product in self.client.get(reverse('search'), {'search': query}).context['products']}
+
+    def test_russian_search_matches_word_forms(self):
+        amber = set(ProductFeatures.objects.filter(
+            feature__feature_filter_name='color', value='Янтарный'
+        ).values_list('product_id', flat=True))
+        cognac = set(ProductFeatures.objects.filter(
+            feature__feature_filter_name='region', value='Коньяк'
+        ).values_list('product_id', flat=True))
+        self.assertTrue(amber & cognac)
+        self.assertEqual(self.search_ids('янтарного'), amber)
+        self.assertEqual(self.search_ids('Коньяков янтарные'), amber & cognac)
+
+    def assertCartMatchesRecalc(self):
+        cart = Cart.objects.get(owner=self.customer, in_order=False)
+        totals = (cart.total_products, cart.final_price)
+        recalc_cart(cart)
+        self.assertEqual(totals, (cart.total_products, cart.final_price))
+        return totals
+
+    def test_cart_delta_matches_recalc(self):
+        first, second = ({'ct_model': 'product', 'slug': product.slug} for product in self.products[:2])
+        self.client.get(reverse('add_to_cart', kwargs=first), HTTP_REFERER='/')
+        self.client.get(reverse('add_to_cart', kwargs=second), HTTP_REFERER='/')
+        self.assertEqual(self.assertCartMatchesRecalc()[0], 2)
+        self.client.post(reverse('change_qty', kwargs=first), {'qty': 4}, HTTP_REFERER='/')
+        self.assertEqual(self.assertCartMatchesRecalc()[0], 5)
+        self.client.get(reverse('delete_from_cart', kwargs=second), HTTP_REFERER='/')
+        self.assertEqual(self.assertCartMatchesRecalc(),
+                         (4, self.products[0].price * 4))
+        self.client.get(reverse('delete_from_cart', kwargs=second), HTTP_REFERER='/')
+        self.assertEqual(self.assertCartMatchesRecalc(),
+                         (4, self.products[0].price * 4))
+
+
+class GenerationTests(TestCase):
+
+    def test_snapshot_reads_shared_namespaces_once(self):
+        store = DatabaseGenerationStore()
+        store.bump(['catalog', 'features:1'])
+        snapshot = GenerationSnapshot(store)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            self.assertEqual(snapshot.get_many(['catalog']), {'catalog': 1})
+            self.assertEqual(snapshot.get_many(['page-categories']), {'page-categories': 0})
+            self.assertEqual(snapshot.get_many(['features:1', 'features:2']), {'features:1': 1, 'features:2': 0})
+            snapshot.get_many(['catalog', 'features:1'])
+        self.assertEqual(len(counter.queries), 2)
+        store.bump(['catalog'])
+        self.assertEqual(snapshot.get_many(['catalog']), {'catalog': 1})
+        self.assertEqual(GenerationSnapshot(store).get_many(['catalog']), {'catalog': 2})
+
+    def test_bump_is_batched(self):
+        store = DatabaseGenerationStore()
+        namespaces = [f'notifications:{user_id}' for user_id in range(300)]
+        store.bump(namespaces[:100])
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            store.bump(namespaces + ['catalog'])
+        self.assertEqual(len(counter.queries), 2)
+        current = GenerationSnapshot(store).get_many(namespaces + ['catalog'])
+        self.assertEqual({current[namespace] for namespace in namespaces[:100]}, {2})
+        self.assertEqual({current[namespace] for namespace in namespaces[100:] + ['catalog']}, {1})
+
+    def test_autocomplete_checks_generation_once_a_second(self):
+        autocomplete_index.load()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            for query in ('т', 'то', 'тов', 'това', 'товар'):
+                self.client.get(reverse('autocomplete'), {'q': query})
+        self.assertEqual(counter.queries, [])
+        get_store().bump(['catalog'])
+        autocomplete_index._checked_at -= AUTOCOMPLETE_VERSION_CHECK_INTERVAL
+        self.client.get(reverse('autocomplete'), {'q': 'тов'})
+        self.assertEqual(autocomplete_index._version, 1)
+
+    def test_cache_store_needs_shared_cache(self):
+        with override_settings(GENERATION_STORE='cache'):
+            self.assertEqual([error.id for error in check_generation_store(None)], ['generations.E002'])
+        self.assertEqual(check_generation_store(None), [])
+
+
+class MetricsAccessTests(TestCase):
+
+    def test_internal_scrape_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.7').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='93.184.216.34').status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_FORWARDED_FOR='93.184.216.34').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_set(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='93.184.216.34', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class BackgroundJobTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        @register_job('test-flaky')
+        def flaky(fail):
+            self.calls.append(fail)
+            if fail:
+                raise ValueError(fail)
+
+        self.addCleanup(JOB_HANDLERS.pop, 'test-flaky')
+
+    def test_failed_job_waits_before_retry(self):
+        job = BackgroundJob.objects.enqueue('test-flaky', fail='нет связи')
+        self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_at), (BackgroundJob.STATUS_PENDING, 1, None))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(run_pending(), 0)
+        BackgroundJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_stale_running_job_is_reclaimed(self):
+        locked_at = timezone.now() - LOCK_TIMEOUT - timedelta(seconds=1)
+        job = BackgroundJob.objects.create(name='test-flaky', payload={'fail': ''}, attempts=1,
+                                           status=BackgroundJob.STATUS_RUNNING, locked_at=locked_at)
+        lost = BackgroundJob.objects.create(name='test-flaky', payload={'fail': ''}, attempts=MAX_ATTEMPTS,
+                                            status=BackgroundJob.STATUS_RUNNING, locked_at=locked_at)
+        fresh = BackgroundJob.objects.create(name='test-flaky', payload={'fail': ''}, attempts=1,
+                                             status=BackgroundJob.STATUS_RUNNING, locked_at=timezone.now())
+        self.assertEqual(run_pending(), 1)
+        statuses = dict(BackgroundJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[job.id], BackgroundJob.STATUS_DONE)
+        self.assertEqual(statuses[lost.id], BackgroundJob.STATUS_FAILED)
+        self.assertEqual(statuses[fresh.id], BackgroundJob.STATUS_RUNNING)
@@ -22,8 +22,13 @@ urlpatterns = [
     path('brands/brands/', BrandsView.as_view(), name='brands'),
     path('clear-notifications/', ClearNotificationsView.as_view(), name='clear-notifications'),
     path('account/orders/<int:pk>/', OrderDetailView.as_view(), name='order-detail'),
+    path('quick-view/<int:pk>/', ProductQuickView.as_view(), name='quick_view'),
+    path('header-fragment/', HeaderFragmentView.as_view(), name='header_fragment'),
     path('add-to-wishlist/<int:product_id>/', AddToWishlistView.as_view(), name='add_to_wishlist'),
     path('remove-from-wishlist/<int:product_id>/', RemoveFromWishlistView.as_view(), name='remove_from_wishlist'),
+    path('instrumentation/', InstrumentationReportView.as_view(), name='instrumentation_report'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('autocomplete/', AutocompleteView.as_view(), name='autocomplete'),
     path('<str:category_slug>/', CategoryDetailView.as_view(), name='category_detail'),
     path('<str:category_slug>/<str:brand_slug>/<str:product_slug>/', ProductDetailView.as_view(), name='product_detail'),
 ]
@@ -1,19 +1,43 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Q
+from django.db.models import OuterRef, Q, Subquery
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.shortcuts import render
 from django import views
 from django.contrib import messages
 from django.views.generic import DetailView
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.utils.cache import patch_cache_control
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth import authenticate, login
 from .forms import LoginForm, RegistrationForm, OrderForm
-from .mixins import CartMixin, NotificationMixin, OwnershipMixin
-from .models import CartProduct, Category, Customer, Product, Brand, Slider, BottleVolume, Order, Notification
-from utils.recalc_cart import recalc_cart
+from .mixins import AnonymousPageCacheMixin, CartMixin, ConditionalGetMixin, NotificationMixin, OwnershipMixin
+from .models import (
+    CartProduct, Category, Customer, Product, Brand, Slider, Baner, BottleVolume, Order, Notification
+)
+from utils.pagination import (
+    PER_PAGE_CHOICES, KeysetPage, keyset_paginate, keyset_paginate_ids, per_page_from_query, sorts_by_id
+)
+from utils.instrumentation import metrics_report
+from utils.metrics import CART_MUTATIONS, ORDERS
+from utils.page_cache import product_tags
+from utils.recalc_cart import apply_cart_delta
+from utils.sqlite import immediate_atomic
+
+from specs.facets import facet_index, filter_by_facets, filter_by_ranges, selected_ranges_from_query
+from .search import search_index
+from .autocomplete import autocomplete_index
+from .prices import get_price_histogram, price_range_from_query
+
+
+INDEX_PRODUCTS = 12
+SEARCH_RESULTS = 100
 
-from specs.models import ProductFeatures
+
+def latest_update(queryset):
+    return Subquery(queryset.order_by('-updated_at').values('updated_at')[:1])
 
 
 class MyQ(Q):
@@ -21,34 +45,46 @@ class MyQ(Q):
     default = 'OR'
 
 
-class IndexView(CartMixin, NotificationMixin, views.View):
+def paginate_products(request, queryset, product_ids=None):
+    paginate = keyset_paginate if product_ids is None else partial(keyset_paginate_ids, ids=product_ids)
+    return paginate(
+        queryset,
+        sort=request.GET.get('sort'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+        per_page=per_page_from_query(request.GET)
+    )
+
+
+class IndexView(AnonymousPageCacheMixin, CartMixin, NotificationMixin, views.View):
+    page_cache_tags = ('categories', 'products', 'sliders', 'banners')
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
         sliders = Slider.objects.all()
-        products = Product.objects.all()
+        baners = Baner.objects.all()
+        products = Product.objects.cards().order_by('-id')[:INDEX_PRODUCTS]
         context = {
-            'categories': categories,
             'products': products,
             'sliders': sliders,
+            'baners': baners,
             'cart': self.cart,
             'notifications': self.notifications(request.user)
         }
         return render(request, 'index.html', context)
 
 
-class CategoryView(CartMixin, NotificationMixin, views.View):
+class CategoryView(AnonymousPageCacheMixin, CartMixin, NotificationMixin, views.View):
     model = Category
-    categories = Category.objects.all()
+    page_cache_tags = ('categories', 'products', 'brands')
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
-        products = Product.objects.all()
+        page = paginate_products(request, Product.objects.cards())
         volumes = BottleVolume.objects.all()
         brands = Brand.objects.all()
         context = {
-            'categories': categories,
-            'products': products,
+            'products': page,
+            'page': page,
+            'per_page_choices': PER_PAGE_CHOICES,
             'volumes': volumes,
             'brands': brands,
             'cart': self.cart,
@@ -57,53 +93,107 @@ class CategoryView(CartMixin, NotificationMixin, views.View):
         return render(request, 'category/categories.html', context)
 
 
-class CategoryDetailView(CartMixin, NotificationMixin, views.generic.DetailView):
+class SearchView(CartMixin, NotificationMixin, views.View):
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('search', '').strip()
+        products = Product.objects.cards()
+        category_id = request.GET.get('category')
+        if category_id and category_id.isdigit():
+            products = products.filter(category_id=category_id)
+        if query:
+            products = search_index.filter(products, query, limit=SEARCH_RESULTS)
+        else:
+            products = products.none()
+        context = {
+            'products': products,
+            'volumes': BottleVolume.objects.all(),
+            'brands': Brand.objects.all(),
+            'query': query,
+            'cart': self.cart,
+            'notifications': self.notifications(request.user)
+        }
+        return render(request, 'category/categories.html', context)
+
+
+class AutocompleteView(views.View):
+
+    def get(self, request, *args, **kwargs):
+        results = autocomplete_index.lookup(request.GET.get('q', ''))
+        return JsonResponse({'results': results})
+
+
+class InstrumentationReportView(views.View):
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            raise Http404
+        return JsonResponse({'views': metrics_report.summary()})
+
+
+class CategoryDetailView(AnonymousPageCacheMixin, ConditionalGetMixin, CartMixin, NotificationMixin,
+                         views.generic.DetailView):
     model = Category
-    categories = Category.objects.all()
     brands = Brand.objects.all()
     volumes = BottleVolume.objects.all()
     template_name = 'category/category_detail.html'
     slug_url_kwarg = 'category_slug'
     context_object_name = 'category'
+    page_cache_tags = ('categories', 'brands')
+
+    def get_page_cache_tags(self):
+        return super().get_page_cache_tags() + [f"category:{self.object.id}"]
+
+    def get_validator_timestamps(self):
+        return Category.objects.filter(slug=self.kwargs[self.slug_url_kwarg]).annotate(
+            products_updated_at=latest_update(Product.objects.filter(category=OuterRef('pk'))),
+            brands_updated_at=latest_update(Brand.objects.all()),
+            menu_updated_at=latest_update(Category.objects.all()),
+        ).values_list('updated_at', 'products_updated_at', 'brands_updated_at', 'menu_updated_at').first()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         query = self.request.GET.get('search')
-        category = self.get_object()
+        category = self.object
         context['cart'] = self.cart
         context['volumes'] = BottleVolume.objects.all()
         context['brands'] = Brand.objects.all()
-        context['categories'] = self.model.objects.all()
-        if not query and not self.request.GET:
-            context['category_products'] = category.product_set.all()
-            return context
+        products = Product.objects.cards().filter(category=category)
+        price_min, price_max = price_range_from_query(self.request.GET)
+        if price_min is not None:
+            products = products.filter(price__gte=price_min)
+        if price_max is not None:
+            products = products.filter(price__lte=price_max)
+        if self.request.GET.get('in_stock'):
+            products = products.filter(out_of_stock=False)
+        products = filter_by_ranges(products, selected_ranges_from_query(category.id, self.request.GET))
+        context['price_histogram'] = get_price_histogram(category.id)
+        context['price_min'] = price_min
+        context['price_max'] = price_max
+        context['per_page_choices'] = PER_PAGE_CHOICES
         if query:
-            products = category.product_set.filter(Q(name__icontains=query))
-            context['category_products'] = products
+            results = search_index.filter(products, query, limit=SEARCH_RESULTS)
+            context['category_products'] = context['page'] = KeysetPage(list(results), 'default')
             return context
-        url_kwargs = {}
-        for item in self.request.GET:
-            if len(self.request.GET.getlist(item)) > 1:
-                url_kwargs[item] = self.request.GET.getlist(item)
-            else:
-                url_kwargs[item] = self.request.GET.get(item)
-        q_condition_queries = Q()
-        for key, value in url_kwargs.items():
-            if isinstance(value, list):
-                q_condition_queries.add(Q(**{'value__in': value}), Q.OR)
-            else:
-                q_condition_queries.add(Q(**{'value': value}), Q.OR)
-        pf = ProductFeatures.objects.filter(
-            q_condition_queries
-        ).prefetch_related('product', 'feature').values('product_id')
-        products = Product.objects.filter(id__in=[pf_['product_id'] for pf_ in pf])
-        context['category_products'] = products
+        selected = facet_index.selected_from_query(category.id, self.request.GET)
+        product_ids = None
+        if selected:
+            product_ids = facet_index.filter_product_ids(category.id, selected)
+            # sorted by id the matches are paged in Python; other sorts filter in SQL, by the id list
+            # while it is short and by the selected values once it is not
+            if not sorts_by_id(self.request.GET.get('sort')):
+                if len(product_ids) > getattr(settings, 'FACET_ID_LIST_LIMIT', 1000):
+                    products = filter_by_facets(products, selected)
+                else:
+                    products = products.filter(id__in=product_ids)
+                product_ids = None
+        context['category_products'] = context['page'] = paginate_products(self.request, products, product_ids)
         return context
 
 
-class BrandsView(CartMixin, NotificationMixin, views.View):
+class BrandsView(AnonymousPageCacheMixin, CartMixin, NotificationMixin, views.View):
     model = Brand
-    categories = Category.objects.all()
+    page_cache_tags = ('categories', 'brands')
 
     def get(self, request, *args, **kwargs):
         brands = Brand.objects.all()
@@ -115,22 +205,50 @@ class BrandsView(CartMixin, NotificationMixin, views.View):
         return render(request, 'brands/brands.html', context)
 
 
-class ProductDetailView(CartMixin, NotificationMixin, views.generic.DetailView):
+class ProductDetailView(AnonymousPageCacheMixin, ConditionalGetMixin, CartMixin, NotificationMixin,
+                        views.generic.DetailView):
     model = Product
     template_name = 'product/product_detail.html'
     slug_url_kwarg = 'product_slug'
     title = 'product_name'
     context_object_name = 'product'
 
+    def get_page_cache_tags(self):
+        return super().get_page_cache_tags() + product_tags(
+            self.object.id, self.object.category_id, self.object.brand_id
+        )
+
+    def get_validator_timestamps(self):
+        return Product.objects.filter(slug=self.kwargs[self.slug_url_kwarg]).annotate(
+            menu_updated_at=latest_update(Category.objects.all()),
+        ).values_list('updated_at', 'category__updated_at', 'brand__updated_at', 'menu_updated_at').first()
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         ct_model = self.model().ct_model
         context['cart'] = self.cart
         context['ct_model'] = ct_model
-        context['categories'] = Category.objects.all()
         return context
 
 
+class ProductQuickView(views.generic.DetailView):
+    queryset = Product.objects.select_related('brand', 'category', 'volume')
+    template_name = 'product/quick_view.html'
+    context_object_name = 'product'
+
+
+class HeaderFragmentView(CartMixin, NotificationMixin, views.View):
+
+    def get(self, request, *args, **kwargs):
+        context = {
+            'cart': self.cart,
+            'notifications': self.notifications(request.user)
+        }
+        response = render(request, '_header_user.html', context)
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
 class LoginView(views.View):
 
     def get(self, request, *args, **kwargs):
@@ -193,14 +311,12 @@ class RegistrationView(views.View):
 
 
 class AccountView(LoginRequiredMixin, CartMixin, NotificationMixin, views.View):
-    categories = Category.objects.all()
 
     def get(self, request, *args, **kwargs):
         customer = Customer.objects.get(user=request.user)
-        categories = Category.objects.all()
         context = {
-            'categories': categories,
             'customer': customer,
+            'orders': customer.orders.select_related('cart'),
             'cart': self.cart,
             'notifications': self.notifications(request.user)
         }
@@ -213,19 +329,18 @@ class OrderDetailView(LoginRequiredMixin, PermissionRequiredMixin, NotificationM
     title = 'order'
     context_object_name = 'order'
     permission_required = 'alcohol.view_order'
+    queryset = Order.objects.select_related('cart')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['cart'] = self.cart
-        context['categories'] = Category.objects.all()
         return context
 
 
 class CartView(CartMixin, NotificationMixin, views.View):
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
-        return render(request, 'cart/cart.html', {'cart': self.cart, 'categories': categories})
+        return render(request, 'cart/cart.html', {'cart': self.cart})
 
 
 class AddToWishlistView(views.View):
@@ -262,12 +377,16 @@ class AddToCartView(CartMixin, views.View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model=ct_model)
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product, created = CartProduct.objects.get_or_create(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
-        if created:
-            self.cart.products.add(cart_product)
-        recalc_cart(self.cart)
+        with immediate_atomic():
+            cart_product, created = CartProduct.objects.get_or_create(
+                user_id=self.cart.owner_id, cart=self.cart, content_type=content_type, object_id=product.id,
+                defaults={'product': product} if isinstance(product, Product) else {}
+            )
+            if created:
+                self.cart.products.add(cart_product)
+                apply_cart_delta(self.cart, cart_product.qty, cart_product.final_price)
+        self.pin_cart(self.cart)
+        CART_MUTATIONS.labels('add').inc()
         messages.add_message(request, messages.INFO, "Товар успешно добавлен")
         return HttpResponseRedirect(request.META['HTTP_REFERER'])
 
@@ -276,12 +395,10 @@ class CheckoutView(LoginRequiredMixin, NotificationMixin, CartMixin, views.View)
 
     def get(self, request, *args, **kwargs):
         customer = Customer.objects.get(user=request.user)
-        categories = Category.objects.all()
         form = OrderForm(request.POST or None, user=request.user)
         first_name = str(customer.user.first_name)
         context = {
             'cart': self.cart,
-            'categories': categories,
             'customer': customer,
             'first_name': first_name,
             'form': form,
@@ -304,12 +421,14 @@ class MakeOrderView(LoginRequiredMixin, NotificationMixin, CartMixin, views.View
             new_order.address = form.cleaned_data['address']
             new_order.buying_type = form.cleaned_data['buying_type']
             new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            self.cart.save()
-            new_order.cart = self.cart
-            new_order.save()
-            customer.orders.add(new_order)
+            with immediate_atomic():
+                new_order.save()
+                self.cart.in_order = True
+                self.cart.save()
+                new_order.cart = self.cart
+                new_order.save()
+                customer.orders.add(new_order)
+            ORDERS.inc()
             messages.add_message(request, messages.INFO, 'Спасибо за заказ! Менеджер с Вами свяжется')
             return HttpResponseRedirect('/checkout-complete/')
         return HttpResponseRedirect('/checkout/')
@@ -319,12 +438,10 @@ class CheckoutCompleteView(LoginRequiredMixin, NotificationMixin, CartMixin, vie
 
     def get(self, request, *args, **kwargs):
         customer = Customer.objects.get(user=request.user)
-        categories = Category.objects.all()
         first_name = str(customer.user.first_name)
         order = customer.orders.last()
         context = {
             'cart': self.cart,
-            'categories': categories,
             'customer': customer,
             'first_name': first_name,
             'notifications': self.notifications(request.user),
@@ -339,12 +456,17 @@ class DeleteFromCartView(CartMixin,  views.View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model=ct_model)
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
-        self.cart.products.remove(cart_product)
-        cart_product.delete()
-        recalc_cart(self.cart)
+        with immediate_atomic():
+            cart_product = CartProduct.objects.select_for_update().filter(
+                user_id=self.cart.owner_id, cart=self.cart, content_type=content_type, object_id=product.id
+            ).first()
+            # a repeated click finds the line already gone and leaves the totals alone
+            if cart_product is not None:
+                self.cart.products.remove(cart_product)
+                cart_product.delete()
+                apply_cart_delta(self.cart, -cart_product.qty, -cart_product.final_price)
+        self.pin_cart(self.cart)
+        CART_MUTATIONS.labels('remove').inc()
         messages.add_message(request, messages.INFO, "Товар удален из корзины")
         return HttpResponseRedirect(request.META['HTTP_REFERER'])
 
@@ -355,17 +477,16 @@ class ChangeQTYView(CartMixin, NotificationMixin, views.View):
         ct_model, product_slug = kwargs.get('ct_model'), kwargs.get('slug')
         content_type = ContentType.objects.get(model='product')
         product = content_type.model_class().objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner, cart=self.cart, content_type=content_type, object_id=product.id
-        )
         qty = int(request.POST.get('qty'))
-        cart_product.qty = qty
-        cart_product.save()
-        recalc_cart(self.cart)
+        with immediate_atomic():
+            cart_product = CartProduct.objects.select_for_update().select_related('product').get(
+                user_id=self.cart.owner_id, cart=self.cart, content_type=content_type, object_id=product.id
+            )
+            previous_qty, previous_price = cart_product.qty, cart_product.final_price
+            cart_product.qty = qty
+            cart_product.save()
+            apply_cart_delta(self.cart, qty - previous_qty, cart_product.final_price - previous_price)
+        self.pin_cart(self.cart)
+        CART_MUTATIONS.labels('change_qty').inc()
         messages.add_message(request, messages.INFO, "Кол-во товаров изменено")
         return HttpResponseRedirect(request.META['HTTP_REFERER'])
-
-
-
-
-
@@ -1,8 +1,15 @@
 #!/bin/sh
 
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
 
 python manage.py migrate --run-syncdb
 
+python manage.py rebuild_search_index --if-empty
+
 python manage.py collectstatic --no-input
 
-gunicorn spirits.wsgi:application --bind 0.0.0.0:8080 --reload  -w 4
+python manage.py run_jobs &
+
+gunicorn spirits.wsgi:application -c gunicorn.conf.py --bind 0.0.0.0:8080 --reload  -w 4
@@ -0,0 +1,240 @@
+import threading
+from collections import defaultdict
+
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, Max, Min, OuterRef
+
+from utils.generations import advance, bump, get_store
+
+from .registry import FACETS_GENERATION, category_generations, get_category_registry
+from .values import NUMERIC_VALUE_TYPES
+
+
+class CategoryFacets:
+
+    def __init__(self, current=None):
+        self.generation = current
+        self.values = defaultdict(lambda: defaultdict(set))
+        self.rows = {}
+
+    def add(self, row_id, filter_name, value, product_id):
+        self.rows[row_id] = (filter_name, value, product_id)
+        self.values[filter_name][value].add(product_id)
+
+    def remove(self, row_id):
+        row = self.rows.pop(row_id, None)
+        if row is None:
+            return
+        filter_name, value, product_id = row
+        product_ids = self.values[filter_name][value]
+        product_ids.discard(product_id)
+        if not product_ids:
+            del self.values[filter_name][value]
+        if not self.values[filter_name]:
+            del self.values[filter_name]
+
+    def filter_names(self):
+        return set(self.values)
+
+    def match(self, selected):
+        result = None
+        for filter_name, values in selected.items():
+            facet = self.values.get(filter_name, {})
+            matched = set()
+            for value in values:
+                matched |= facet.get(value, set())
+            result = matched if result is None else result & matched
+            if not result:
+                return set()
+        return result if result is not None else set()
+
+
+# category -> feature filter name -> value -> product ids, loaded lazily per category and
+# kept up to date by the ProductFeatures / CategoryFeature signals in specs.models; a category
+# is reloaded when another worker moved its generation counters
+class FacetIndex:
+
+    def __init__(self):
+        self._categories = {}
+        self._lock = threading.RLock()
+
+    def _load(self, category_id, current):
+        from .models import ProductFeatures
+
+        facets = CategoryFacets(current)
+        rows = ProductFeatures.objects.filter(feature__category_id=category_id).values_list(
+            'id', 'feature__feature_filter_name', 'value', 'product_id'
+        )
+        for row_id, filter_name, value, product_id in rows:
+            facets.add(row_id, filter_name, value, product_id)
+        return facets
+
+    def get(self, category_id):
+        current = category_generations(category_id)
+        with self._lock:
+            facets = self._categories.get(category_id)
+            if facets is None or facets.generation != current:
+                facets = self._categories[category_id] = self._load(category_id, current)
+            return facets
+
+    def selected_from_query(self, category_id, query_dict):
+        filter_names = self.get(category_id).filter_names()
+        return {key: query_dict.getlist(key) for key in query_dict if key in filter_names}
+
+    def filter_product_ids(self, category_id, selected):
+        with self._lock:
+            return self.get(category_id).match(selected)
+
+    # a saved or deleted row is applied to this worker's copy only once it is committed, together with the
+    # bump that makes the other workers reload the category; when the counter moved by exactly that bump,
+    # this worker's copy is current and keeps serving without a reload
+    def _apply_after_commit(self, category_id, change):
+        def apply():
+            namespace = FACETS_GENERATION.format(category_id=category_id)
+            store = get_store()
+            with self._lock:
+                facets = self._categories.get(category_id)
+                if facets is not None:
+                    change(facets)
+            store.bump([namespace])
+            if facets is None or not store.increments:
+                return
+            current = store.load([namespace]).get(namespace, 0)
+            with self._lock:
+                if self._categories.get(category_id) is facets and facets.generation[0] + 1 == current:
+                    facets.generation = (current,) + facets.generation[1:]
+                    advance(namespace, current)
+
+        cache.delete(facet_sidebar_key(category_id))
+        transaction.on_commit(apply)
+
+    def update(self, product_feature):
+        feature = product_feature.feature
+        row = (product_feature.id, feature.feature_filter_name, product_feature.value, product_feature.product_id)
+
+        def change(facets):
+            facets.remove(row[0])
+            facets.add(*row)
+
+        self._apply_after_commit(feature.category_id, change)
+
+    def remove(self, product_feature):
+        self._apply_after_commit(product_feature.feature.category_id, lambda facets: facets.remove(product_feature.id))
+
+    def invalidate(self, category_id=None):
+        with self._lock:
+            if category_id is None:
+                self._categories.clear()
+            else:
+                self._categories.pop(category_id, None)
+
+
+facet_index = FacetIndex()
+
+
+FACET_SIDEBAR_CACHE_KEY = 'facet-sidebar:v3:{category_id}:{generation}'
+FACET_SIDEBAR_CACHE_TIMEOUT = 60 * 60
+
+
+def facet_sidebar_key(category_id):
+    current = '-'.join(str(value) for value in category_generations(category_id))
+    return FACET_SIDEBAR_CACHE_KEY.format(category_id=category_id, generation=current)
+
+
+def get_facet_sidebar(category_id):
+    key = facet_sidebar_key(category_id)
+    sidebar = cache.get(key)
+    if sidebar is None:
+        sidebar = build_facet_sidebar(category_id)
+        cache.set(key, sidebar, FACET_SIDEBAR_CACHE_TIMEOUT)
+    return sidebar
+
+
+def build_facet_sidebar(category_id):
+    from .models import ProductFeatures
+
+    features = ProductFeatures.objects.filter(feature__category_id=category_id)
+    rows = features.exclude(feature__value_type__in=NUMERIC_VALUE_TYPES).values(
+        'feature_id', 'feature__feature_name', 'feature__feature_filter_name', 'value'
+    ).annotate(products=Count('product_id', distinct=True)).order_by('feature_id', 'value')
+    sidebar = []
+    for row in rows:
+        if not sidebar or sidebar[-1]['feature_id'] != row['feature_id']:
+            sidebar.append({
+                'feature_id': row['feature_id'],
+                'feature_name': row['feature__feature_name'],
+                'filter_name': row['feature__feature_filter_name'],
+                'numeric': False,
+                'values': []
+            })
+        sidebar[-1]['values'].append((row['value'], row['products']))
+    ranges = features.filter(feature__value_type__in=NUMERIC_VALUE_TYPES, numeric_value__isnull=False).values(
+        'feature_id', 'feature__feature_name', 'feature__feature_filter_name', 'feature__unit'
+    ).annotate(min=Min('numeric_value'), max=Max('numeric_value')).order_by('feature_id')
+    for row in ranges:
+        sidebar.append({
+            'feature_id': row['feature_id'],
+            'feature_name': row['feature__feature_name'],
+            'filter_name': row['feature__feature_filter_name'],
+            'unit': row['feature__unit'] or '',
+            'numeric': True,
+            'min': format(row['min'].normalize(), 'f'),
+            'max': format(row['max'].normalize(), 'f'),
+            'values': []
+        })
+    return sorted(sidebar, key=lambda facet: facet['feature_id'])
+
+
+def invalidate_facet_sidebar(category_id):
+    cache.delete(facet_sidebar_key(category_id))
+    bump(FACETS_GENERATION.format(category_id=category_id))
+
+
+def parse_bound(value):
+    try:
+        bound = Decimal(value)
+    except (InvalidOperation, TypeError):
+        return None
+    return bound if bound.is_finite() else None
+
+
+# "<filter name>_min" / "<filter name>_max" query parameters of numeric features
+def selected_ranges_from_query(category_id, query_dict):
+    ranges = []
+    for feature in get_category_registry(category_id)['features']:
+        if feature['value_type'] not in NUMERIC_VALUE_TYPES:
+            continue
+        low = parse_bound(query_dict.get(f"{feature['feature_filter_name']}_min"))
+        high = parse_bound(query_dict.get(f"{feature['feature_filter_name']}_max"))
+        if low is not None or high is not None:
+            ranges.append((feature['id'], low, high))
+    return ranges
+
+
+# the facet selection as EXISTS subqueries on (feature, value), for match sets too large to send
+# as a list of ids: values of one feature are united, features are intersected
+def filter_by_facets(queryset, selected):
+    from .models import ProductFeatures
+
+    for filter_name, values in selected.items():
+        queryset = queryset.filter(Exists(ProductFeatures.objects.filter(
+            product_id=OuterRef('pk'), feature__category_id=OuterRef('category_id'),
+            feature__feature_filter_name=filter_name, value__in=values
+        )))
+    return queryset
+
+
+def filter_by_ranges(queryset, ranges):
+    from .models import ProductFeatures
+
+    for feature_id, low, high in ranges:
+        matches = ProductFeatures.objects.filter(feature_id=feature_id)
+        if low is not None:
+            matches = matches.filter(numeric_value__gte=low)
+        if high is not None:
+            matches = matches.filter(numeric_value__lte=high)
+        queryset = queryset.filter(id__in=matches.values('product_id'))
+    return queryset
@@ -0,0 +1,10 @@
+from utils.jobs import register_job
+from .facets import facet_index, invalidate_facet_sidebar
+from .values import backfill_numeric_values
+
+
+@register_job('backfill_feature_values')
+def backfill_feature_values(feature_id, category_id):
+    backfill_numeric_values([feature_id])
+    facet_index.invalidate(category_id)
+    invalidate_facet_sidebar(category_id)
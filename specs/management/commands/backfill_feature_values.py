@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from specs.values import backfill_numeric_values
+
+
+class Command(BaseCommand):
+    help = 'Заполняет числовые значения характеристик по типу значения характеристики'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--feature', type=int, action='append', dest='feature_ids',
+                            help='Обработать только указанные характеристики (id)')
+
+    def handle(self, *args, **options):
+        result = backfill_numeric_values(options['feature_ids'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Обновлено значений: {result['updated']}"))
+        if result['invalid']:
+            self.stdout.write(self.style.WARNING(f"Не удалось разобрать как число: {result['invalid']}"))
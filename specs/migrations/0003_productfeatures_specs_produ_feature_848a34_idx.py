@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specs', '0002_auto_20211121_1344'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productfeatures',
+            index=models.Index(fields=['feature', 'value'], name='specs_produ_feature_848a34_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+def mark_validated_features_as_enum(apps, schema_editor):
+    CategoryFeature = apps.get_model('specs', 'CategoryFeature')
+    FeatureValidator = apps.get_model('specs', 'FeatureValidator')
+    CategoryFeature.objects.filter(
+        id__in=FeatureValidator.objects.values('feature_key_id')
+    ).update(value_type='enum')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specs', '0003_productfeatures_specs_produ_feature_848a34_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryfeature',
+            name='value_type',
+            field=models.CharField(choices=[('string', 'Строка'), ('int', 'Целое число'), ('decimal', 'Дробное число'), ('enum', 'Значение из списка')], default='string', max_length=10, verbose_name='Тип значения'),
+        ),
+        migrations.AddField(
+            model_name='productfeatures',
+            name='numeric_value',
+            field=models.DecimalField(blank=True, decimal_places=3, editable=False, max_digits=12, null=True, verbose_name='Числовое значение'),
+        ),
+        migrations.AddIndex(
+            model_name='productfeatures',
+            index=models.Index(fields=['feature', 'numeric_value'], name='specs_produ_feature_fc1eb5_idx'),
+        ),
+        migrations.RunPython(mark_validated_features_as_enum, migrations.RunPython.noop),
+    ]
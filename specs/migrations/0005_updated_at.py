@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('specs', '0004_typed_feature_values'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productfeatures',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+    ]
@@ -1,4 +1,15 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from alcohol.models import BackgroundJob, Category, Product
+from alcohol.search import search_index
+from utils.page_cache import invalidate_tags
+
+from .facets import facet_index, invalidate_facet_sidebar
+from .registry import get_category_registry, get_feature, invalidate_category_registry
+from .values import NUMERIC_VALUE_TYPES, VALUE_TYPE_STRING, VALUE_TYPES, clean_feature_value
 
 
 class CategoryFeature(models.Model):
@@ -7,6 +18,8 @@ class CategoryFeature(models.Model):
     feature_name = models.CharField(verbose_name='Имя ключа для категории', max_length=50)
     feature_filter_name = models.CharField(verbose_name='Имя для фильтра', max_length=50)
     unit = models.CharField(max_length=50, verbose_name='Единица измерения', null=True, blank=True)
+    value_type = models.CharField(max_length=10, choices=VALUE_TYPES, default=VALUE_TYPE_STRING,
+                                  verbose_name='Тип значения')
 
     class Meta:
         unique_together = ('category', 'feature_name', 'feature_filter_name')
@@ -14,6 +27,17 @@ class CategoryFeature(models.Model):
     def __str__(self):
         return f"{self.category.name} | {self.feature_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'value_type' in field_names:
+            instance._loaded_value_type = instance.value_type
+        return instance
+
+    @property
+    def is_numeric(self):
+        return self.value_type in NUMERIC_VALUE_TYPES
+
 
 class FeatureValidator(models.Model):
 
@@ -27,13 +51,132 @@ class FeatureValidator(models.Model):
                f"Валидное значение {self.valid_feature_value}"
 
 
+class ProductFeaturesManager(models.Manager):
+
+    def bulk_set_values(self, products, values):
+        products = list(products.only('id', 'category_id'))
+        category_ids = {product.category_id for product in products}
+        registries = {category_id: get_category_registry(category_id) for category_id in category_ids}
+        targets = {}
+        errors = []
+        for category_id, registry in registries.items():
+            for feature_name, value in values.items():
+                feature = get_feature(registry, feature_name)
+                if feature is None:
+                    continue
+                allowed_values = {v['value'] for v in registry['validators'].get(feature['id'], [])}
+                try:
+                    numeric_value = clean_feature_value(feature_name, feature['value_type'], value, allowed_values)
+                except ValidationError as e:
+                    errors.extend(e.messages)
+                    continue
+                targets[(category_id, feature_name)] = (feature['id'], value, numeric_value)
+        if errors:
+            raise ValidationError(errors)
+        new_values = {}
+        for product in products:
+            for feature_name in values:
+                target = targets.get((product.category_id, feature_name))
+                if target:
+                    new_values[(product.id, target[0])] = target[1:]
+        changed = []
+        matched = 0
+        product_features = self.get_queryset().filter(
+            product_id__in=[product.id for product in products],
+            feature_id__in={target[0] for target in targets.values()}
+        ).select_related('feature')
+        for product_feature in product_features:
+            new_value = new_values.get((product_feature.product_id, product_feature.feature_id))
+            if new_value is None:
+                continue
+            matched += 1
+            if (product_feature.value, product_feature.numeric_value) != new_value:
+                product_feature.value, product_feature.numeric_value = new_value
+                product_feature.updated_at = timezone.now()
+                changed.append(product_feature)
+        with transaction.atomic():
+            self.bulk_update(changed, ['value', 'numeric_value', 'updated_at'], batch_size=500)
+            Product.objects.touch({product_feature.product_id for product_feature in changed})
+        for category_id in {product_feature.feature.category_id for product_feature in changed}:
+            invalidate_facet_sidebar(category_id)
+        search_index.index_products({product_feature.product_id for product_feature in changed})
+        invalidate_tags(*{f"product:{product_feature.product_id}" for product_feature in changed},
+                        *{f"category:{product_feature.feature.category_id}" for product_feature in changed})
+        return {'updated': len(changed), 'unchanged': matched - len(changed), 'missing': len(new_values) - matched}
+
+
 class ProductFeatures(models.Model):
 
     product = models.ForeignKey("alcohol.Product", verbose_name='Товар', on_delete=models.CASCADE)
     feature = models.ForeignKey(CategoryFeature, verbose_name='Характеристика', on_delete=models.CASCADE)
     value = models.CharField(max_length=255, verbose_name='Значение')
+    numeric_value = models.DecimalField(max_digits=12, decimal_places=3, null=True, blank=True, editable=False,
+                                        verbose_name='Числовое значение')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+    objects = ProductFeaturesManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['feature', 'value']),
+            models.Index(fields=['feature', 'numeric_value']),
+        ]
 
     def __str__(self):
         return f"Товар - {self.product.name} | " \
                f"Характеристика - {self.feature.feature_name} | " \
                f"Значение - {self.value}"
+
+    def clean(self):
+        if self.feature_id:
+            self.numeric_value = self.clean_value()
+
+    def save(self, *args, **kwargs):
+        self.numeric_value = self.clean_value()
+        super().save(*args, **kwargs)
+
+    def clean_value(self):
+        registry = get_category_registry(self.feature.category_id)
+        allowed_values = {v['value'] for v in registry['validators'].get(self.feature_id, [])}
+        return clean_feature_value(self.feature.feature_name, self.feature.value_type, self.value, allowed_values)
+
+
+def update_facet_index(instance, **kwargs):
+    Product.objects.touch([instance.product_id])
+    facet_index.update(instance)
+    search_index.index_products([instance.product_id])
+    invalidate_tags(f"product:{instance.product_id}", f"category:{instance.feature.category_id}")
+
+
+def remove_from_facet_index(instance, **kwargs):
+    Product.objects.touch([instance.product_id])
+    facet_index.remove(instance)
+    search_index.index_products([instance.product_id])
+    invalidate_tags(f"product:{instance.product_id}", f"category:{instance.feature.category_id}")
+
+
+def invalidate_category_facets(instance, **kwargs):
+    Category.objects.filter(id=instance.category_id).update(updated_at=timezone.now())
+    facet_index.invalidate(instance.category_id)
+    invalidate_facet_sidebar(instance.category_id)
+    invalidate_category_registry(instance.category_id)
+    invalidate_tags(f"category:{instance.category_id}")
+
+
+def backfill_on_type_change(instance, created, **kwargs):
+    if created or getattr(instance, '_loaded_value_type', instance.value_type) == instance.value_type:
+        return
+    instance._loaded_value_type = instance.value_type
+    BackgroundJob.objects.enqueue('backfill_feature_values', feature_id=instance.id, category_id=instance.category_id)
+
+
+def invalidate_validators(instance, **kwargs):
+    invalidate_category_registry(instance.category_id)
+
+
+post_save.connect(update_facet_index, sender=ProductFeatures)
+post_delete.connect(remove_from_facet_index, sender=ProductFeatures)
+post_save.connect(invalidate_category_facets, sender=CategoryFeature)
+post_delete.connect(invalidate_category_facets, sender=CategoryFeature)
+post_save.connect(backfill_on_type_change, sender=CategoryFeature)
+post_save.connect(invalidate_validators, sender=FeatureValidator)
+post_delete.connect(invalidate_validators, sender=FeatureValidator)
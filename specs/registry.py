@@ -0,0 +1,68 @@
+import hashlib
+import json
+
+from django.core.cache import cache
+
+from utils.generations import bump, generations
+
+REGISTRY_CACHE_KEY = 'feature-registry:v4:{category_id}:{generation}'
+REGISTRY_GENERATION = 'category-features:{category_id}'
+FACETS_GENERATION = 'features:{category_id}'
+
+
+# both counters of a category are read together: the facet index and sidebar follow the registry
+def category_generations(category_id):
+    namespaces = (FACETS_GENERATION.format(category_id=category_id),
+                  REGISTRY_GENERATION.format(category_id=category_id))
+    current = generations(namespaces)
+    return tuple(current[namespace] for namespace in namespaces)
+
+
+REGISTRY_CACHE_TIMEOUT = 60 * 60
+
+
+# the generation in the key retires registries cached by workers that missed the change
+def registry_key(category_id):
+    return REGISTRY_CACHE_KEY.format(category_id=category_id, generation=category_generations(category_id)[1])
+
+
+def get_category_registry(category_id):
+    key = registry_key(category_id)
+    registry = cache.get(key)
+    if registry is None:
+        registry = build_category_registry(category_id)
+        cache.set(key, registry, REGISTRY_CACHE_TIMEOUT)
+    return registry
+
+
+def build_category_registry(category_id):
+    from .models import CategoryFeature, FeatureValidator
+
+    features = list(CategoryFeature.objects.filter(category_id=category_id).order_by('id').values(
+        'id', 'feature_name', 'feature_filter_name', 'unit', 'value_type'
+    ))
+    validators = {feature['id']: [] for feature in features}
+    for validator in FeatureValidator.objects.filter(category_id=category_id).order_by('id').values(
+            'id', 'feature_key_id', 'valid_feature_value'):
+        validators.setdefault(validator['feature_key_id'], []).append(
+            {'id': validator['id'], 'value': validator['valid_feature_value']}
+        )
+    # a hash of the content, so every worker that builds the same registry hands out the same ETag
+    version = hashlib.md5(json.dumps([features, validators], sort_keys=True).encode()).hexdigest()
+    return {
+        'version': version,
+        'features': features,
+        'validators': validators
+    }
+
+
+def get_feature(registry, feature_name):
+    for feature in registry['features']:
+        if feature['feature_name'] == feature_name:
+            return feature
+    return None
+
+
+def invalidate_category_registry(category_id):
+    cache.delete(registry_key(category_id))
+    bump(REGISTRY_GENERATION.format(category_id=category_id))
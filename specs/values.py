@@ -0,0 +1,81 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+VALUE_TYPE_STRING = 'string'
+VALUE_TYPE_INT = 'int'
+VALUE_TYPE_DECIMAL = 'decimal'
+VALUE_TYPE_ENUM = 'enum'
+
+VALUE_TYPES = (
+    (VALUE_TYPE_STRING, 'Строка'),
+    (VALUE_TYPE_INT, 'Целое число'),
+    (VALUE_TYPE_DECIMAL, 'Дробное число'),
+    (VALUE_TYPE_ENUM, 'Значение из списка'),
+)
+NUMERIC_VALUE_TYPES = (VALUE_TYPE_INT, VALUE_TYPE_DECIMAL)
+
+# leading number of values such as "40", "40,5 %", "12+" or "0.7 л"
+NUMBER_RE = re.compile(r'^\s*(-?\d+(?:[.,]\d+)?)')
+
+
+def parse_number(value):
+    match = NUMBER_RE.match(value or '')
+    if not match:
+        return None
+    try:
+        return Decimal(match.group(1).replace(',', '.'))
+    except InvalidOperation:
+        return None
+
+
+# returns the number stored in ProductFeatures.numeric_value (None for string and enum features)
+def clean_feature_value(feature_name, value_type, value, allowed_values=None):
+    if value_type not in NUMERIC_VALUE_TYPES:
+        # a string feature that got validators after it was created is held to them like an enum
+        if (allowed_values or value_type == VALUE_TYPE_ENUM) and value not in (allowed_values or ()):
+            raise ValidationError(f"Значение '{value}' недопустимо для характеристики '{feature_name}'")
+        return None
+    number = parse_number(value)
+    if number is None:
+        raise ValidationError(f"Значение '{value}' характеристики '{feature_name}' должно быть числом")
+    if value_type == VALUE_TYPE_INT and number != number.to_integral_value():
+        raise ValidationError(f"Значение '{value}' характеристики '{feature_name}' должно быть целым числом")
+    if allowed_values and number not in {parse_number(allowed) for allowed in allowed_values}:
+        raise ValidationError(f"Значение '{value}' недопустимо для характеристики '{feature_name}'")
+    return number
+
+
+def backfill_numeric_values(feature_ids=None, batch_size=500):
+    from alcohol.models import Product
+    from .models import ProductFeatures
+
+    rows = ProductFeatures.objects.select_related('feature').only(
+        'id', 'product_id', 'value', 'numeric_value', 'feature__value_type'
+    ).order_by('id')
+    if feature_ids is not None:
+        rows = rows.filter(feature_id__in=feature_ids)
+    updated = invalid = 0
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        changed = []
+        for row in batch:
+            numeric_value = None
+            if row.feature.value_type in NUMERIC_VALUE_TYPES:
+                numeric_value = parse_number(row.value)
+                if numeric_value is None:
+                    invalid += 1
+            if row.numeric_value != numeric_value:
+                row.numeric_value = numeric_value
+                row.updated_at = timezone.now()
+                changed.append(row)
+        ProductFeatures.objects.bulk_update(changed, ['numeric_value', 'updated_at'])
+        Product.objects.touch({row.product_id for row in changed})
+        updated += len(changed)
+    return {'updated': updated, 'invalid': invalid}
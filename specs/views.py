@@ -1,13 +1,34 @@
-from collections import defaultdict
+import hashlib
+import json
 
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import render
 from django.views.generic import View
 from django.http import HttpResponseRedirect, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 
 from .models import CategoryFeature, FeatureValidator, ProductFeatures
 from .forms import NewCategoryFeatureKeyForm, NewCategoryForm
+from .registry import get_category_registry, get_feature
 from alcohol.models import Category, Product
+from alcohol.search import search_index
+
+
+def content_etag(data):
+    return hashlib.md5(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def etag_json_response(request, etag, build_data):
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(build_data())
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 class BaseSpecView(View):
@@ -60,21 +81,12 @@ class CreateNewFeatureValidator(View):
 class FeatureChoiceView(View):
 
     def get(self, request, *args, **kwargs):
-        option = '<option value="{value}">{option_name}</option>'
-        html_select = """
-            <select class="form-select" name="feature-validators" id="feature-validators-id" aria-label="Default select example">
-                <option selected>---</option>
-                {result}
-            </select>
-                    """
-        feature_key_qs = CategoryFeature.objects.filter(
-            category_id=int(request.GET.get('category_id'))
-        )
-        res_string = ""
-        for item in feature_key_qs:
-            res_string += option.format(value=item.feature_name, option_name=item.feature_name)
-        html_select = html_select.format(result=res_string)
-        return JsonResponse({"result": html_select, "value": int(request.GET.get('category_id'))})
+        category_id = int(request.GET.get('category_id'))
+        registry = get_category_registry(category_id)
+        return etag_json_response(request, f"registry-{category_id}-{registry['version']}", lambda: {
+            "features": [{"id": f['id'], "name": f['feature_name']} for f in registry['features']],
+            "value": category_id
+        })
 
 
 class CreateFeatureView(View):
@@ -117,76 +129,60 @@ class SearchProductAjaxView(View):
         query = request.GET.get('query')
         category_id = request.GET.get('category_id')
         category = Category.objects.get(id=int(category_id))
-        products = list(Product.objects.filter(
-            category=category,
-            title__icontains=query
-        ).values())
-        return JsonResponse({"result": products})
+        products = search_index.filter(Product.objects.filter(category=category), query or '', limit=20)
+        return JsonResponse({"result": list(products.values('id', 'name', 'price'))})
 
 
 class AttachNewFeatureToProduct(View):
 
     def get(self, request, *args, **kwargs):
-        res_string = ""
-        product = Product.objects.get(id=int(request.GET.get('product_id')))
-        existing_features = list(set([item.feature.feature_name for item in product.features.all()]))
-        print(existing_features)
-        category_features = CategoryFeature.objects.filter(
-            category=product.category
-        ).exclude(feature_name__in=existing_features)
-        option = '<option value="{value}">{option_name}</option>'
-        html_select = """
-            <select class="form-select" name="product-category-features" id="product-category-features-id" aria-label="Default select example">
-                <option selected>---</option>
-                {result}
-            </select>
-                    """
-        for item in category_features:
-            res_string += option.format(value=item.category.id, option_name=item.feature_name)
-        html_select = html_select.format(result=res_string)
-        return JsonResponse({"features": html_select})
+        product = Product.objects.only('id', 'category_id').get(id=int(request.GET.get('product_id')))
+        registry = get_category_registry(product.category_id)
+        existing_features = set(
+            ProductFeatures.objects.filter(product=product).values_list('feature__feature_name', flat=True)
+        )
+        data = {
+            "category_id": product.category_id,
+            "features": [
+                {"id": f['id'], "name": f['feature_name']} for f in registry['features']
+                if f['feature_name'] not in existing_features
+            ]
+        }
+        return etag_json_response(request, content_etag(data), lambda: data)
 
 
 class ProductFeatureChoicesAjaxView(View):
 
     def get(self, request, *args, **kwargs):
-        res_string = ""
-        category = Category.objects.get(id=int(request.GET.get('category_id')))
-        feature_key = CategoryFeature.objects.get(
-            category=category,
-            feature_name=request.GET.get('product_feature_name')
-        )
-        validators_qs = FeatureValidator.objects.filter(
-            category=category,
-            feature_key=feature_key
+        category_id = int(request.GET.get('category_id'))
+        feature_name = request.GET.get('product_feature_name')
+        registry = get_category_registry(category_id)
+        feature = get_feature(registry, feature_name)
+        if feature is None:
+            return JsonResponse({"error": f"Характеристика '{feature_name}' не найдена"}, status=404)
+        return etag_json_response(
+            request, f"registry-{category_id}-{registry['version']}-{feature['id']}",
+            lambda: {"feature": feature, "values": registry['validators'].get(feature['id'], [])}
         )
-        option = '<option value="{value}">{option_name}</option>'
-        html_select = """
-            <select class="form-select" name="product-category-features-choices" id="product-category-features-choices-id" aria-label="Default select example">
-                <option selected>---</option>
-                {result}
-            </select>
-                    """
-        for item in validators_qs:
-            res_string += option.format(value=item.id, option_name=item.valid_feature_value)
-        html_select = html_select.format(result=res_string)
-        return JsonResponse({"features": html_select})
 
 
 class CreateNewProductFeatureAjaxView(View):
 
     def get(self, request, *args, **kwargs):
-        product = Product.objects.get(title=request.GET.get('product'))
+        product = Product.objects.get(name=request.GET.get('product'))
         category_feature = CategoryFeature.objects.get(
             category=product.category,
             feature_name=request.GET.get('category_feature')
         )
         value = request.GET.get('value')
-        feature = ProductFeatures.objects.create(
-            feature=category_feature,
-            product=product,
-            value=value
-        )
+        try:
+            feature = ProductFeatures.objects.create(
+                feature=category_feature,
+                product=product,
+                value=value
+            )
+        except ValidationError as e:
+            return JsonResponse({"error": ' '.join(e.messages)}, status=400)
         product.features.add(feature)
         return JsonResponse({"OK": "OK"})
 
@@ -202,101 +198,50 @@ class UpdateProductFeaturesView(View):
 class ShowProductFeaturesForUpdate(View):
 
     def get(self, request, *args, **kwargs):
-        product = Product.objects.get(id=int(request.GET.get('product_id')))
-        features_values_qs = product.features.all()
-        head = """
-        <hr>
-            <div class="row">
-                <div class="col-md-4">
-                    <h4 class="text-center">Характеристика</h4>
-                </div>
-                <div class="col-md-4">
-                    <h4 class="text-center">Текущее значение</h4>
-                </div>
-                <div class="col-md-4">
-                    <h4 class="text-center">Новое значение</h4>
-                </div>
-            </div>
-        <div class='row'>{}</div>
-        <div class="row">
-        <hr>
-        <div class="col-md-4">
-        </div>
-        <div class="col-md-4">
-            <p class='text-center'><button class="btn btn-success" id="save-updated-features">Сохранить</button></p> 
-        </div>
-        <div class="col-md-4">
-        </div>
-        </div>
-        """
-        option = '<option value="{value}">{option_name}</option>'
-        select_values = """
-            <select class="form-select" name="feature-value" id="feature-value" aria-label="Default select example">
-                <option selected>---</option>
-                {result}
-            </select>
-                    """
-        mid_res = ""
-        select_different_values_dict = defaultdict(list)
-        for item in features_values_qs:
-            fv_qs = FeatureValidator.objects.filter(
-                category=item.product.category,
-                feature_key=item.feature
-            ).values()
-            for fv in fv_qs:
-                if fv['valid_feature_value'] == item.value:
-                    pass
-                else:
-                    select_different_values_dict[fv['feature_key_id']].append(fv['valid_feature_value'])
-            feature_field = '<input type="text" class="form-control" id="{id}" value="{value}" disabled/>'
-            current_feature_value = """
-            <div class='col-md-4 feature-current-value' style='margin-top:10px; margin-bottom:10px;'>{}</div>
-                                    """
-            body_feature_field = """
-            <div class='col-md-4 feature-name' style='margin-top:10px; margin-bottom:10px;'>{}</div>
-                                """
-            body_feature_field_value = """
-            <div class='col-md-4 feature-new-value' style='margin-top:10px; margin-bottom:10px;'>{}</div>
-            """
-            body_feature_field = body_feature_field.format(feature_field.format(id=item.feature.id, value=item.feature.feature_name))
-            current_feature_value_mid_res = ""
-            for item_ in select_different_values_dict[item.feature.id]:
-                current_feature_value_mid_res += option.format(value=item.feature.id, option_name=item_)
-            body_feature_field_value = body_feature_field_value.format(
-                select_values.format(item.feature.id, result=current_feature_value_mid_res)
-            )
-            current_feature_value = current_feature_value.format(feature_field.format(id=item.feature.id, value=item.value))
-            m = body_feature_field + current_feature_value + body_feature_field_value
-            mid_res += m
-        result = head.format(mid_res)
-        return JsonResponse({"result": result})
+        product = Product.objects.only('id', 'name', 'category_id').get(id=int(request.GET.get('product_id')))
+        registry = get_category_registry(product.category_id)
+        product_features = ProductFeatures.objects.filter(product=product).select_related('feature').order_by('id')
+        data = {
+            "product": {"id": product.id, "name": product.name, "category_id": product.category_id},
+            "features": [
+                {
+                    "id": item.feature_id,
+                    "name": item.feature.feature_name,
+                    "value": item.value,
+                    "choices": [
+                        v['value'] for v in registry['validators'].get(item.feature_id, []) if v['value'] != item.value
+                    ]
+                }
+                for item in product_features
+            ]
+        }
+        return etag_json_response(request, content_etag(data), lambda: data)
 
 
 class UpdateProductFeaturesAjaxView(View):
 
     def post(self, request, *args, **kwargs):
         features_names = request.POST.getlist('features_names')
-        features_current_values = request.POST.getlist('features_current_values')
         new_feature_values = request.POST.getlist('new_feature_values')
-        data_for_update = [{'feature_name': name, 'current_value': curr_val, 'new_value': new_val} for name, curr_val, new_val
-                           in zip(features_names, features_current_values, new_feature_values)]
-        product = Product.objects.get(title=request.POST.get('product'))
-        for item in product.features.all():
-            for item_for_update in data_for_update:
-                if item.feature.feature_name == item_for_update['feature_name']:
-                    if item.value != item_for_update['new_value'] and item_for_update['new_value'] != '---':
-                        cf = CategoryFeature.objects.get(
-                            category=product.category,
-                            feature_name=item_for_update['feature_name']
-                        )
-                        item.value = FeatureValidator.objects.get(
-                            category=product.category,
-                            feature_key=cf,
-                            valid_feature_value=item_for_update['new_value']
-                        ).valid_feature_value
-                        item.save()
+        values = {name: new_val for name, new_val in zip(features_names, new_feature_values)
+                  if new_val and new_val != '---'}
+        products = self.get_products(request)
+        try:
+            result = ProductFeatures.objects.bulk_set_values(products, values)
+        except ValidationError as e:
+            return JsonResponse({"error": ' '.join(e.messages)}, status=400)
         messages.add_message(
             request, messages.SUCCESS,
-            f'Значения характеристик для товара {product.title} успешно обновлены'
+            f'Значения характеристик обновлены: {result["updated"]}'
         )
-        return JsonResponse({"result": "ok"})
+        return JsonResponse({"result": "ok", **result})
+
+    @staticmethod
+    def get_products(request):
+        product_ids = request.POST.getlist('product_ids') or request.POST.getlist('product_id')
+        if request.POST.get('brand_id'):
+            products = Product.objects.filter(brand_id=int(request.POST.get('brand_id')))
+            if request.POST.get('category_id'):
+                products = products.filter(category_id=int(request.POST.get('category_id')))
+            return products
+        return Product.objects.filter(id__in=[int(product_id) for product_id in product_ids])
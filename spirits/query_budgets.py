@@ -0,0 +1,45 @@
+# url name -> maximum number of SQL queries for one request with cold caches. The middleware checks
+# every request against it (settings.QUERY_BUDGET_ACTION) and alcohol.tests runs each view on a small
+# and on a large catalog with 'raise', so a view whose query count grows with the number of products,
+# cart lines, orders or notifications fails there
+QUERY_BUDGETS = {
+    'index': 14,
+    'login': 10,
+    'logout': 4,
+    'registration': 4,
+    'account': 15,
+    'cart': 10,
+    'add_to_cart': 17,
+    'delete_from_cart': 15,
+    'change_qty': 13,
+    'checkout': 12,
+    'make_order': 13,
+    'checkout-complete': 13,
+    'categories': 9,
+    'brands': 11,
+    'clear-notifications': 4,
+    'order-detail': 7,
+    'quick_view': 3,
+    'header_fragment': 7,
+    'add_to_wishlist': 5,
+    'remove_from_wishlist': 5,
+    'instrumentation_report': 2,
+    'search': 15,
+    'autocomplete': 4,
+    'category_detail': 24,
+    'product_detail': 15,
+    'product-list-for-features': 2,
+    'new-feature': 3,
+    'new-category': 11,
+    'new-validator': 3,
+    'feature-choice-validators': 5,
+    'create-feature': 9,
+    'new-product-feature': 3,
+    'search-product': 5,
+    'attach-feature': 7,
+    'product-feature': 3,
+    'attach-new-product-feature': 15,
+    'update-product-features': 3,
+    'show-product-features-for-update': 5,
+    'update-product-features-ajax': 13,
+}
@@ -2,6 +2,8 @@ import os
 import environ
 from pathlib import Path
 
+from . import query_budgets
+
 
 # env = environ.Env()
 # environ.Env.read_env('.env')
@@ -35,6 +37,7 @@ INSTALLED_APPS = [
     'specs',
     'ckeditor',
     'crispy_forms',
+    'crispy_bootstrap5',
     'active_link',
 ]
 
@@ -44,6 +47,8 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 
 MIDDLEWARE = [
+    'utils.instrumentation.InstrumentationMiddleware',
+    'utils.generations.GenerationSnapshotMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,8 +56,37 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.profiling.ProfilerMiddleware',
 ]
 
+# queries per request allowed for a URL name; 'raise' turns an overrun into an error (staging, tests)
+QUERY_BUDGETS = query_budgets.QUERY_BUDGETS
+QUERY_BUDGET_ACTION = os.environ.get('QUERY_BUDGET_ACTION', 'log')
+
+# anonymous catalog pages are cached for PAGE_CACHE_TIMEOUT seconds (0 disables the page cache)
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# a category filtered by facet values matching more products than this is filtered with subqueries
+# instead of a list of product ids
+FACET_ID_LIST_LIMIT = 1000
+
+# menu, footer, slider and banner fragments are versioned, so they can live long
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# staff requests with an "X-Profile" header or "?_profile=1" are sampled every PROFILER_INTERVAL
+# seconds and stored as ProfileRecord (admin)
+PROFILER_INTERVAL = 0.002
+
+# generation counters that every per-process cache is keyed or checked on, shared by the workers and
+# run_jobs: 'db' (any number of nodes), 'cache' (needs a shared CACHES backend, see the system check)
+# or 'file' (one node)
+GENERATION_STORE = os.environ.get('GENERATION_STORE', 'db')
+GENERATION_STORE_PATH = os.environ.get('GENERATION_STORE_PATH', BASE_DIR / 'generations.json')
+
+# when set, /metrics requires "Authorization: Bearer <token>"; otherwise it only answers direct requests
+# from loopback or private addresses
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 ROOT_URLCONF = 'spirits.urls'
 
 TEMPLATES = [
@@ -67,6 +101,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'alcohol.context_processors.catalog',
             ],
         },
     },
@@ -78,9 +113,22 @@ WSGI_APPLICATION = 'spirits.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# SQLite profile of small installs (utils.sqlite engine): WAL lets readers work next to the writer,
+# busy_timeout makes a writer wait for the lock instead of failing with "database is locked",
+# cart and order writes take the lock up front (SQLITE_IMMEDIATE_TRANSACTIONS)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+SQLITE_IMMEDIATE_TRANSACTIONS = True
+
 DATABASES = {
    'default': {
-       'ENGINE': 'django.db.backends.sqlite3',
+       'ENGINE': 'utils.sqlite',
        'NAME': BASE_DIR / 'db.sqlite3',
    }
 }
@@ -3,10 +3,13 @@ from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from utils.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', include('alcohol.urls')),
-    path('product-specs/', include('specs.urls'))
+    path('metrics', metrics_view, name='metrics'),
+    path('product-specs/', include('specs.urls')),
+    path('', include('alcohol.urls'))
 ]
 
 if settings.DEBUG:
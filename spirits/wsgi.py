@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'spirits.settings')
 
 application = get_wsgi_application()
+
+from alcohol.autocomplete import autocomplete_index  # noqa: E402
+
+autocomplete_index.warm()
@@ -0,0 +1,50 @@
+$(function () {
+    var input = $('input[data-autocomplete-url]');
+    var suggestions = $('#search-suggestions');
+    var kinds = {category: 'Категория', brand: 'Бренд', product: 'Товар'};
+    var timer = null;
+    var lastQuery = '';
+
+    function hide() {
+        suggestions.addClass('d-none').empty();
+    }
+
+    input.on('input', function () {
+        var query = $.trim(input.val());
+        clearTimeout(timer);
+        if (query.length < 2) {
+            lastQuery = '';
+            hide();
+            return;
+        }
+        timer = setTimeout(function () {
+            lastQuery = query;
+            $.getJSON(input.data('autocomplete-url'), {q: query}, function (data) {
+                if (query !== lastQuery) {
+                    return;
+                }
+                suggestions.empty();
+                $.each(data.results, function (i, item) {
+                    $('<a class="list-group-item list-group-item-action d-flex justify-content-between"></a>')
+                        .attr('href', item.url)
+                        .append($('<span></span>').text(item.label))
+                        .append($('<small class="text-muted"></small>').text(kinds[item.kind]))
+                        .appendTo(suggestions);
+                });
+                suggestions.toggleClass('d-none', !data.results.length);
+            });
+        }, 150);
+    });
+
+    input.on('keydown', function (e) {
+        if (e.key === 'Escape') {
+            hide();
+        }
+    });
+
+    $(document).on('click', function (e) {
+        if (!$(e.target).closest(input.parent()).length) {
+            hide();
+        }
+    });
+});
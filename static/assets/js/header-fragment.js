@@ -0,0 +1,15 @@
+document.addEventListener('DOMContentLoaded', function () {
+    var header = document.getElementById('header-user');
+    if (!header || !header.getAttribute('data-fragment-url')) {
+        return;
+    }
+    fetch(header.getAttribute('data-fragment-url'), {credentials: 'same-origin'})
+        .then(function (response) {
+            return response.ok ? response.text() : null;
+        })
+        .then(function (html) {
+            if (html !== null) {
+                header.innerHTML = html;
+            }
+        });
+});
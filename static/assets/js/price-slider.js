@@ -1,16 +1,30 @@
-$(function() {
-	"use strict";
-
-	var slider = document.getElementById('slider');
-
-		noUiSlider.create(slider, {
-			start: [20, 80],
-			connect: true,
-			range: {
-				'min': 0,
-				'max': 100
-			}
-		});
-
-
-});
\ No newline at end of file
+document.addEventListener('DOMContentLoaded', function () {
+    var slider = document.getElementById('price-slider');
+    if (!slider || typeof noUiSlider === 'undefined') {
+        return;
+    }
+    var low = parseInt(slider.dataset.min, 10);
+    var high = parseInt(slider.dataset.max, 10);
+    if (!(high > low)) {
+        slider.remove();
+        return;
+    }
+    var form = slider.closest('form');
+    var inputs = [form.querySelector('[name="price_min"]'), form.querySelector('[name="price_max"]')];
+    noUiSlider.create(slider, {
+        start: [inputs[0].value || low, inputs[1].value || high],
+        connect: true,
+        step: 1,
+        range: {min: low, max: high}
+    });
+    slider.noUiSlider.on('slide', function (values, handle) {
+        inputs[handle].value = Math.round(values[handle]);
+    });
+    inputs.forEach(function (input, handle) {
+        input.addEventListener('change', function () {
+            var values = [null, null];
+            values[handle] = input.value || (handle ? high : low);
+            slider.noUiSlider.set(values);
+        });
+    });
+});
@@ -0,0 +1,11 @@
+document.addEventListener('show.bs.modal', function (e) {
+    if (e.target.id !== 'quick-view-modal' || !e.relatedTarget) {
+        return;
+    }
+    var content = $(e.target).find('.modal-content');
+    content.empty().load(e.relatedTarget.getAttribute('data-quick-view-url'), function () {
+        content.find('[data-bs-toggle="popover"]').each(function () {
+            new bootstrap.Popover(this);
+        });
+    });
+});
@@ -0,0 +1,188 @@
+import fcntl
+import json
+import os
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F, Q
+
+GENERATION_CACHE_KEY = 'generation:{namespace}'
+BUMP_BATCH_SIZE = 500
+
+current_snapshot = ContextVar('current_generations', default=None)
+
+
+# shared namespaces ('catalog', 'page-categories') are few and read by most requests; per-object
+# ones ('features:<category>', 'notifications:<user>') are many and read on demand
+def is_shared(namespace):
+    return ':' not in namespace
+
+
+# one row per namespace; a namespace without a row is at generation 0. Every read also
+# brings the shared namespaces, so a request usually reads the table once, and a bump of any number
+# of namespaces is two statements per batch: insert the missing rows, then increment them all
+class DatabaseGenerationStore:
+    loads_shared = True
+    loads_everything = False
+    increments = True
+
+    def load(self, namespaces):
+        from alcohol.models import Generation
+
+        rows = Generation.objects.filter(Q(namespace__in=list(namespaces)) | ~Q(namespace__contains=':'))
+        return dict(rows.values_list('namespace', 'value'))
+
+    def bump(self, namespaces):
+        from alcohol.models import Generation
+
+        namespaces = sorted(set(namespaces))
+        for start in range(0, len(namespaces), BUMP_BATCH_SIZE):
+            batch = namespaces[start:start + BUMP_BATCH_SIZE]
+            Generation.objects.bulk_create([Generation(namespace=namespace) for namespace in batch],
+                                           ignore_conflicts=True)
+            Generation.objects.filter(namespace__in=batch).update(value=F('value') + 1)
+
+
+# only agrees across workers when CACHES points to a shared backend (memcached, redis);
+# a counter starts from the clock and a bump moves it to the clock again, so it never returns to a
+# value a worker may already hold and all namespaces are written with one set_many()
+class CacheGenerationStore:
+    loads_shared = False
+    loads_everything = False
+    increments = False
+
+    def load(self, namespaces):
+        keys = {GENERATION_CACHE_KEY.format(namespace=namespace): namespace for namespace in namespaces}
+        found = cache.get_many(list(keys))
+        for key in keys:
+            if key not in found:
+                cache.add(key, time.time_ns(), None)
+                found[key] = cache.get(key)
+        return {namespace: found[key] for key, namespace in keys.items()}
+
+    def bump(self, namespaces):
+        now = time.time_ns()
+        cache.set_many({GENERATION_CACHE_KEY.format(namespace=namespace): now for namespace in namespaces}, None)
+
+
+# a JSON file shared by the workers of one node, rewritten under an exclusive lock
+class FileGenerationStore:
+    loads_shared = True
+    loads_everything = True
+    increments = True
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def load(self, namespaces):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def bump(self, namespaces):
+        with open(f'{self.path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            values = self.load(namespaces)
+            for namespace in namespaces:
+                values[namespace] = values.get(namespace, time.time_ns()) + 1
+            temporary = f'{self.path}.{os.getpid()}'
+            with open(temporary, 'w') as f:
+                json.dump(values, f)
+            os.replace(temporary, self.path)
+
+
+def get_store():
+    backend = getattr(settings, 'GENERATION_STORE', 'db')
+    if backend == 'db':
+        return DatabaseGenerationStore()
+    if backend == 'cache':
+        return CacheGenerationStore()
+    if backend == 'file':
+        return FileGenerationStore(settings.GENERATION_STORE_PATH)
+    raise ImproperlyConfigured(f"Неизвестное хранилище поколений GENERATION_STORE: {backend}")
+
+
+# counters read once per request and then reused, so every local cache in a request sees the same state
+class GenerationSnapshot:
+
+    def __init__(self, store):
+        self.store = store
+        self.values = {}
+        self.shared_loaded = False
+        self.loaded = False
+
+    def known(self, namespace):
+        return namespace in self.values or self.loaded or (self.shared_loaded and is_shared(namespace))
+
+    def get_many(self, namespaces):
+        missing = [namespace for namespace in namespaces if not self.known(namespace)]
+        if missing:
+            self.values.update(self.store.load(missing))
+            for namespace in missing:
+                self.values.setdefault(namespace, 0)
+            self.shared_loaded = self.shared_loaded or self.store.loads_shared
+            self.loaded = self.store.loads_everything
+        return {namespace: self.values.get(namespace, 0) for namespace in namespaces}
+
+
+def generations(namespaces):
+    snapshot = current_snapshot.get()
+    if snapshot is None:
+        snapshot = GenerationSnapshot(get_store())
+    return snapshot.get_many(namespaces)
+
+
+def generation(namespace):
+    return generations([namespace])[namespace]
+
+
+# a worker that bumped a namespace and brought its own copy up to date lets the rest of the request
+# read at the new generation
+def advance(namespace, value):
+    snapshot = current_snapshot.get()
+    if snapshot is not None:
+        snapshot.values[namespace] = value
+
+
+# in-process caches of every worker reload what they hold for a namespace once its counter moves. The
+# counter only moves after commit and the request keeps its snapshot, so an invalidator that also wants
+# the rest of the writing request to see the change deletes its local cache entry as well
+def bump(*namespaces):
+    transaction.on_commit(lambda: get_store().bump(namespaces))
+
+
+class GenerationSnapshotMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_snapshot.set(GenerationSnapshot(get_store()))
+        try:
+            return self.get_response(request)
+        finally:
+            current_snapshot.reset(token)
+
+
+# with a per-process cache (the default LocMemCache) 'cache' counters would never leave the worker
+@checks.register(checks.Tags.caches)
+def check_generation_store(app_configs, **kwargs):
+    backend = getattr(settings, 'GENERATION_STORE', 'db')
+    if backend not in ('db', 'cache', 'file'):
+        return [checks.Error(f"Неизвестное хранилище поколений GENERATION_STORE: {backend}",
+                             id='generations.E001')]
+    cache_backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend == 'cache' and cache_backend.endswith(('LocMemCache', 'DummyCache')):
+        return [checks.Error(
+            "GENERATION_STORE = 'cache' требует общего для всех процессов кэша в CACHES",
+            hint="Настройте memcached/redis в CACHES или используйте GENERATION_STORE = 'db' / 'file'",
+            id='generations.E002',
+        )]
+    return []
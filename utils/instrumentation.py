@@ -0,0 +1,225 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.backends.django import Template as DjangoTemplate
+
+from .metrics import observe_request
+
+logger = logging.getLogger('spirits.instrumentation')
+
+current_metrics = ContextVar('current_metrics', default=None)
+_in_get_many = ContextVar('in_get_many', default=False)
+
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+DUPLICATE_THRESHOLD = 2
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def fingerprint(sql):
+    return IN_LIST_RE.sub('(%s...)', sql)
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.fingerprints = Counter()
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count >= DUPLICATE_THRESHOLD}
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'cache;desc="hit {self.cache_hits} / miss {self.cache_misses}"',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ])
+
+
+def query_wrapper(metrics):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            metrics.record_query(sql, time.perf_counter() - started)
+    return wrapper
+
+
+# per URL name totals of this worker, shown by the staff report view
+class MetricsReport:
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def add(self, view_name, metrics):
+        with self._lock:
+            row = self._views.setdefault(view_name, {
+                'requests': 0, 'time': 0.0, 'db_time': 0.0, 'template_time': 0.0, 'queries': 0,
+                'max_queries': 0, 'duplicate_queries': 0, 'cache_hits': 0, 'cache_misses': 0
+            })
+            row['requests'] += 1
+            row['time'] += metrics.total_time
+            row['db_time'] += metrics.db_time
+            row['template_time'] += metrics.template_time
+            row['queries'] += metrics.queries
+            row['max_queries'] = max(row['max_queries'], metrics.queries)
+            row['duplicate_queries'] += sum(count - 1 for count in metrics.duplicates().values())
+            row['cache_hits'] += metrics.cache_hits
+            row['cache_misses'] += metrics.cache_misses
+
+    def summary(self):
+        with self._lock:
+            views = {name: dict(row) for name, row in self._views.items()}
+        report = []
+        for name, row in sorted(views.items()):
+            requests = row['requests']
+            report.append({
+                'view': name,
+                'requests': requests,
+                'avg_ms': round(row['time'] * 1000 / requests, 1),
+                'avg_db_ms': round(row['db_time'] * 1000 / requests, 1),
+                'avg_template_ms': round(row['template_time'] * 1000 / requests, 1),
+                'avg_queries': round(row['queries'] / requests, 1),
+                'max_queries': row['max_queries'],
+                'duplicate_queries': row['duplicate_queries'],
+                'budget': get_query_budget(name),
+                'cache_hits': row['cache_hits'],
+                'cache_misses': row['cache_misses'],
+            })
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+metrics_report = MetricsReport()
+
+
+def get_query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+def check_query_budget(view_name, metrics):
+    budget = get_query_budget(view_name)
+    if budget is None or metrics.queries <= budget:
+        return
+    message = f'{view_name}: {metrics.queries} queries, budget {budget}'
+    duplicates = metrics.duplicates()
+    if duplicates:
+        message += '; repeated: ' + '; '.join(f'{count}x {sql[:200]}' for sql, count in duplicates.items())
+    if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+_patched = False
+
+
+def instrument_templates_and_cache():
+    global _patched
+    if _patched:
+        return
+    _patched = True
+
+    template_render = DjangoTemplate.render
+
+    def render(self, *args, **kwargs):
+        metrics = current_metrics.get()
+        if metrics is None:
+            return template_render(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return template_render(self, *args, **kwargs)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+    DjangoTemplate.render = render
+
+    missing = object()
+    cache_class = type(caches['default'])
+    cache_get = cache_class.get
+    cache_get_many = cache_class.get_many
+
+    def get(self, key, default=None, version=None):
+        value = cache_get(self, key, missing, version)
+        metrics = current_metrics.get()
+        if metrics is not None and not _in_get_many.get():
+            if value is missing:
+                metrics.cache_misses += 1
+            else:
+                metrics.cache_hits += 1
+        return default if value is missing else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        token = _in_get_many.set(True)
+        try:
+            values = cache_get_many(self, keys, version)
+        finally:
+            _in_get_many.reset(token)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.cache_hits += len(values)
+            metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    cache_class.get = get
+    cache_class.get_many = get_many
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates_and_cache()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(query_wrapper(metrics)))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        if view_name:
+            metrics_report.add(view_name, metrics)
+            observe_request(view_name, request.method, response.status_code, metrics)
+            check_query_budget(view_name, metrics)
+        # only a user the view has already loaded, so the header costs no extra query
+        user = getattr(request, '_cached_user', None)
+        if settings.DEBUG or (user is not None and user.is_staff):
+            response['Server-Timing'] = metrics.server_timing()
+        return response
@@ -0,0 +1,83 @@
+import traceback
+from datetime import timedelta
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from alcohol.models import BackgroundJob
+from .metrics import JOBS_PROCESSED
+
+JOB_HANDLERS = {}
+MAX_ATTEMPTS = 3
+# a 'running' job not finished within LOCK_TIMEOUT is taken to belong to a dead worker, so the timeout
+# has to be longer than the slowest job
+LOCK_TIMEOUT = timedelta(minutes=15)
+# a failed attempt is retried after RETRY_DELAY, doubled with every attempt
+RETRY_DELAY = timedelta(seconds=30)
+
+
+def register_job(name):
+    def decorator(func):
+        JOB_HANDLERS[name] = func
+        return func
+    return decorator
+
+
+def autodiscover_jobs():
+    autodiscover_modules('jobs')
+
+
+# the attempt is counted when the job is taken, so a job that kills its worker still runs out of attempts
+def claim(job):
+    job.locked_at = timezone.now()
+    claimed = BackgroundJob.objects.filter(id=job.id, status=BackgroundJob.STATUS_PENDING).update(
+        status=BackgroundJob.STATUS_RUNNING, locked_at=job.locked_at, attempts=F('attempts') + 1
+    )
+    if claimed:
+        job.status = BackgroundJob.STATUS_RUNNING
+        job.attempts += 1
+    return bool(claimed)
+
+
+def retry_delay(attempts):
+    return RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def reclaim_stale(timeout=LOCK_TIMEOUT):
+    stale = BackgroundJob.objects.stale(timeout)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=BackgroundJob.STATUS_FAILED, locked_at=None, processed_at=timezone.now(),
+        error='Обработчик не завершил задачу за отведенное время'
+    )
+    return failed + stale.update(status=BackgroundJob.STATUS_PENDING, locked_at=None, run_after=timezone.now())
+
+
+def run_job(job):
+    try:
+        JOB_HANDLERS[job.name](**job.payload)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = BackgroundJob.STATUS_FAILED
+        else:
+            job.status = BackgroundJob.STATUS_PENDING
+            job.run_after = timezone.now() + retry_delay(job.attempts)
+    else:
+        job.error = None
+        job.status = BackgroundJob.STATUS_DONE
+    job.locked_at = None
+    job.processed_at = timezone.now()
+    job.save(update_fields=['error', 'status', 'run_after', 'locked_at', 'processed_at'])
+    JOBS_PROCESSED.labels(job.name, job.status).inc()
+    return job.status == BackgroundJob.STATUS_DONE
+
+
+def run_pending(limit=100):
+    reclaim_stale()
+    processed = 0
+    for job in BackgroundJob.objects.pending()[:limit]:
+        if claim(job):
+            run_job(job)
+            processed += 1
+    return processed
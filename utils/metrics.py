@@ -0,0 +1,84 @@
+import ipaddress
+import os
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404, HttpResponse
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+
+from alcohol.models import BackgroundJob
+
+# With PROMETHEUS_MULTIPROC_DIR set (see entrypoint.sh and gunicorn.conf.py) every
+# worker writes its samples to mmap files in that directory and a scrape of any
+# worker sums them up. It has to be set before prometheus_client is imported.
+
+REQUESTS = Counter('spirits_requests_total', 'HTTP requests', ['view', 'method', 'status'])
+REQUEST_DURATION = Histogram(
+    'spirits_request_duration_seconds', 'Request processing time', ['view'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+DB_QUERIES = Counter('spirits_db_queries_total', 'Database queries', ['view'])
+CACHE_REQUESTS = Counter('spirits_cache_requests_total', 'Cache lookups made while serving requests', ['result'])
+CART_MUTATIONS = Counter('spirits_cart_mutations_total', 'Cart changes', ['action'])
+ORDERS = Counter('spirits_orders_total', 'Placed orders')
+JOBS_PROCESSED = Counter('spirits_background_jobs_processed_total', 'Processed background jobs', ['name', 'status'])
+
+
+def observe_request(view_name, method, status, metrics):
+    REQUESTS.labels(view_name, method, status).inc()
+    REQUEST_DURATION.labels(view_name).observe(metrics.total_time)
+    DB_QUERIES.labels(view_name).inc(metrics.queries)
+    if metrics.cache_hits:
+        CACHE_REQUESTS.labels('hit').inc(metrics.cache_hits)
+    if metrics.cache_misses:
+        CACHE_REQUESTS.labels('miss').inc(metrics.cache_misses)
+
+
+# queue length is read from the database at scrape time instead of being kept per worker
+class JobQueueCollector:
+
+    def collect(self):
+        gauge = GaugeMetricFamily('spirits_background_jobs', 'Background jobs by status', labels=['status'])
+        counts = dict.fromkeys(dict(BackgroundJob.STATUS_CHOICES), 0)
+        counts.update(BackgroundJob.objects.order_by().values_list('status').annotate(jobs=Count('id')))
+        for status, jobs in counts.items():
+            gauge.add_metric([status], jobs)
+        yield gauge
+
+
+job_registry = CollectorRegistry(auto_describe=False)
+job_registry.register(JobQueueCollector())
+
+
+def metrics_registry():
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+# without METRICS_TOKEN only a scraper that reaches a worker directly from loopback or a private network
+# is answered; requests that came through nginx carry X-Forwarded-For and are refused
+def metrics_allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        return constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if 'X-Forwarded-For' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        raise Http404
+    output = generate_latest(metrics_registry()) + generate_latest(job_registry)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
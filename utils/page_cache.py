@@ -0,0 +1,92 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .generations import bump, generations
+
+PAGE_CACHE_KEY = 'page:{digest}'
+PAGE_CACHE_TAG_NAMESPACE = 'page-{tag}'
+PAGE_CACHE_HEADERS = ('Content-Type', 'Content-Language', 'ETag', 'Last-Modified', 'Cache-Control')
+IGNORED_QUERY_PARAMS = ('gclid', 'yclid', 'fbclid', '_openstat')
+
+
+def page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 10)
+
+
+def normalized_query(query_dict):
+    items = sorted(
+        (key, value) for key, values in query_dict.lists() for value in values
+        if value and not key.startswith('utm_') and key not in IGNORED_QUERY_PARAMS
+    )
+    return urlencode(items)
+
+
+def page_cache_key(request):
+    digest = hashlib.md5(f"{request.path}?{normalized_query(request.GET)}".encode()).hexdigest()
+    return PAGE_CACHE_KEY.format(digest=digest)
+
+
+def is_cacheable_request(request):
+    return (
+        page_cache_timeout() > 0 and request.method == 'GET' and not request.user.is_authenticated
+    )
+
+
+# pages rendered with a CSRF token, a new session or pending messages belong to one visitor
+def is_cacheable_response(request, response):
+    if response.status_code != 200 or response.cookies or response.has_header('Set-Cookie'):
+        return False
+    if request.META.get('CSRF_COOKIE_USED'):
+        return False
+    session = getattr(request, 'session', None)
+    if session is not None and session.modified:
+        return False
+    storage = getattr(request, '_messages', None)
+    return not (storage is not None and storage._queued_messages)
+
+
+# tag versions are generation counters, so a write in any worker or in run_jobs retires the pages
+# every worker holds in its own cache
+def tag_versions(tags):
+    namespaces = {PAGE_CACHE_TAG_NAMESPACE.format(tag=tag): tag for tag in tags}
+    return {namespaces[namespace]: version for namespace, version in generations(namespaces).items()}
+
+
+def get_cached_page(request):
+    entry = cache.get(page_cache_key(request))
+    if entry is None:
+        return None
+    if tag_versions(entry['tags']) != entry['tags']:
+        return None
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers'].items():
+        response[header] = value
+    return response
+
+
+def store_page(request, response, tags):
+    versions = tag_versions(tags)
+    cache.set(page_cache_key(request), {
+        'content': response.content,
+        'status': response.status_code,
+        'headers': {header: response[header] for header in PAGE_CACHE_HEADERS if response.has_header(header)},
+        'tags': versions,
+    }, page_cache_timeout())
+
+
+# a changed tag version makes every page stored with the old one a miss
+def invalidate_tags(*tags):
+    bump(*[PAGE_CACHE_TAG_NAMESPACE.format(tag=tag) for tag in tags])
+
+
+def product_tags(product_id, category_id=None, brand_id=None):
+    tags = [f"product:{product_id}"]
+    if category_id:
+        tags.append(f"category:{category_id}")
+    if brand_id:
+        tags.append(f"brand:{brand_id}")
+    return tags
@@ -0,0 +1,162 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# every sort ends with the primary key so that the key is unique and the page
+# boundaries are stable when several rows share a price or a name
+SORT_KEYS = {
+    'default': ('id',),
+    'price': ('price', 'id'),
+    'price-desc': ('-price', '-id'),
+    'name': ('name', 'id'),
+    'newest': ('-id',),
+}
+DEFAULT_SORT = 'default'
+PER_PAGE = 12
+PER_PAGE_CHOICES = (9, 12, 16, 20, 50, 100)
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, sort, per_page=PER_PAGE, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.sort = sort
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def encode_cursor(values):
+    data = json.dumps(values, default=str, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+# a cursor comes from the query string, so its values are converted by the sort fields before they
+# reach a filter; anything that does not fit the fields is treated as no cursor
+def clean_cursor(model, fields, values):
+    if values is None or len(values) != len(fields):
+        return None
+    cleaned = []
+    for field, value in zip(fields, values):
+        try:
+            value = model._meta.get_field(field.lstrip('-')).to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+        if value is None:
+            return None
+        cleaned.append(value)
+    return cleaned
+
+
+def seek_filter(fields, values, backwards=False):
+    condition = Q()
+    equal = Q()
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        descending = field.startswith('-') != backwards
+        condition |= equal & Q(**{f"{name}__{'lt' if descending else 'gt'}": value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def reverse_ordering(fields):
+    return [field[1:] if field.startswith('-') else f"-{field}" for field in fields]
+
+
+def row_key(row, fields):
+    return [getattr(row, field.lstrip('-')) for field in fields]
+
+
+def keyset_paginate(queryset, sort=None, after=None, before=None, per_page=PER_PAGE):
+    sort = sort if sort in SORT_KEYS else DEFAULT_SORT
+    fields = SORT_KEYS[sort]
+    backwards = not after and bool(before)
+    cursor = clean_cursor(queryset.model, fields, decode_cursor(before if backwards else after))
+    if cursor is None:
+        backwards = False
+    if cursor is not None:
+        queryset = queryset.filter(seek_filter(fields, cursor, backwards))
+    ordering = reverse_ordering(fields) if backwards else fields
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    return build_page(rows, sort, fields, per_page, cursor, backwards)
+
+
+def build_page(rows, sort, fields, per_page, cursor, backwards):
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    has_next = True if backwards else has_more
+    has_previous = has_more if backwards else cursor is not None
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor(row_key(rows[-1], fields))
+    if rows and has_previous:
+        previous_cursor = encode_cursor(row_key(rows[0], fields))
+    return KeysetPage(rows, sort, per_page, next_cursor, previous_cursor)
+
+
+def sorts_by_id(sort):
+    return len(SORT_KEYS.get(sort, SORT_KEYS[DEFAULT_SORT])) == 1
+
+
+# the same pages as keyset_paginate() for a set of ids already known in Python (facet matches) and a
+# sort by id alone: only the ids of one page go to the database, in growing chunks while the
+# queryset's own filters drop some of them
+def keyset_paginate_ids(queryset, ids, sort=None, after=None, before=None, per_page=PER_PAGE):
+    sort = sort if sort in SORT_KEYS else DEFAULT_SORT
+    fields = SORT_KEYS[sort]
+    backwards = not after and bool(before)
+    cursor = clean_cursor(queryset.model, fields, decode_cursor(before if backwards else after))
+    if cursor is None:
+        backwards = False
+    descending = fields[0].startswith('-') != backwards
+    candidates = sorted(ids, reverse=descending)
+    if cursor is not None:
+        candidates = [pk for pk in candidates if (pk < cursor[0] if descending else pk > cursor[0])]
+    rows = []
+    position = 0
+    chunk_size = per_page + 1
+    while len(rows) <= per_page and position < len(candidates):
+        chunk = candidates[position:position + chunk_size]
+        position += len(chunk)
+        found = {row.pk: row for row in queryset.filter(pk__in=chunk)}
+        rows.extend(found[pk] for pk in chunk if pk in found)
+        chunk_size *= 2
+    return build_page(rows[:per_page + 1], sort, fields, per_page, cursor, backwards)
+
+
+def per_page_from_query(query_dict):
+    try:
+        per_page = int(query_dict.get('per_page', PER_PAGE))
+    except ValueError:
+        return PER_PAGE
+    return per_page if per_page in PER_PAGE_CHOICES else PER_PAGE
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_FLAG = '_profile'
+SQL_LOG_LIMIT = 500
+
+_path_prefixes = sorted({path for path in sys.path if path} | {str(settings.BASE_DIR)}, key=len, reverse=True)
+
+
+def frame_label(code):
+    filename = code.co_filename
+    for prefix in _path_prefixes:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+# Wall-clock sampler of one thread: every interval it walks that thread's current
+# stack and counts it in the collapsed format ("root;...;leaf count") that
+# flamegraph.pl and speedscope read
+class SamplingProfiler:
+
+    def __init__(self, thread_id, interval=None):
+        self.thread_id = thread_id
+        self.interval = interval or getattr(settings, 'PROFILER_INTERVAL', 0.002)
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def samples(self):
+        return sum(self.stacks.values())
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class SQLLog:
+
+    def __init__(self):
+        self.entries = []
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            if len(self.entries) < SQL_LOG_LIMIT:
+                self.entries.append({
+                    'sql': sql,
+                    'params': [str(param) for param in params] if params and not many else [],
+                    'ms': round((time.perf_counter() - started) * 1000, 2)
+                })
+
+
+def profile_label(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return None
+    label = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_QUERY_FLAG)
+    if not label or label == '0':
+        return None
+    return '' if label == '1' else label[:100]
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        label = profile_label(request)
+        if label is None:
+            return self.get_response(request)
+        from alcohol.models import ProfileRecord
+
+        sql_log = SQLLog()
+        profiler = SamplingProfiler(threading.get_ident())
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            with connections['default'].execute_wrapper(sql_log):
+                response = self.get_response(request)
+        finally:
+            profiler.stop()
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        record = ProfileRecord.objects.create(
+            label=label,
+            path=request.get_full_path()[:500],
+            view_name=match.view_name if match else '',
+            user=request.user,
+            status_code=response.status_code,
+            duration_ms=round(duration * 1000, 1),
+            samples=profiler.samples,
+            query_count=sql_log.count,
+            collapsed_stacks=profiler.collapsed(),
+            sql_log=sql_log.entries
+        )
+        response['X-Profile-Id'] = str(record.id)
+        return response
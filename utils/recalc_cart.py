@@ -1,12 +1,20 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models.functions import Coalesce
 
 
 def recalc_cart(cart):
-    cart_data = cart.products.aggregate(models.Sum('final_price'), models.Sum('qty'), models.Count('id'))
-    if cart_data.get('final_price__sum', 'qty__sum'):
-        cart.final_price = cart_data['final_price__sum']
-        cart.qty = cart_data['qty__sum']
-    else:
-        cart.final_price = 0
-    cart.qty = cart_data['qty__sum']
-    cart.save()
+    cart_data = cart.products.aggregate(models.Sum('final_price'), models.Sum('qty'))
+    cart.final_price = cart_data['final_price__sum'] or 0
+    cart.total_products = cart_data['qty__sum'] or 0
+    cart.save(update_fields=['final_price', 'total_products'])
+
+
+def apply_cart_delta(cart, qty, price):
+    cart.__class__.objects.filter(pk=cart.pk).update(
+        total_products=models.F('total_products') + qty,
+        final_price=Coalesce(models.F('final_price'), models.Value(Decimal('0.00'))) + price
+    )
+    cart.total_products += qty
+    cart.final_price = (cart.final_price or 0) + price
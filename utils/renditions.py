@@ -0,0 +1,82 @@
+import posixpath
+from io import BytesIO
+
+from PIL import Image, features
+from django.core.files.base import ContentFile
+
+
+RENDITION_PRESETS = {
+    'cart': (90, 90),
+    'card': (400, 400),
+    'zoom': (1000, 1000),
+    'slider': (1600, 700),
+}
+
+RENDITION_DENSITIES = (1, 2)
+
+RENDITION_FIELDS = {
+    'alcohol.product': {'image': ('card', 'cart', 'zoom')},
+    'alcohol.brand': {'image': ('card',), 'big_image': ('zoom',)},
+    'alcohol.slider': {'image': ('slider',)},
+    'alcohol.baner': {'image': ('slider',)},
+    'alcohol.imagegallery': {'image': ('card', 'zoom')},
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def rendition_formats():
+    formats = [('jpg', 'JPEG')]
+    if features.check('webp'):
+        formats.insert(0, ('webp', 'WEBP'))
+    return formats
+
+
+def rendition_name(name, preset, density=1, extension='jpg'):
+    root, _ = posixpath.splitext(name)
+    suffix = preset if density == 1 else f"{preset}_{density}x"
+    return f"{root}_{suffix}.{extension}"
+
+
+def _flatten(image):
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def generate_renditions(field_file, presets):
+    storage = field_file.storage
+    with field_file.open('rb') as f:
+        original = Image.open(f)
+        original.load()
+    created = []
+    for preset in presets:
+        width, height = RENDITION_PRESETS[preset]
+        for density in RENDITION_DENSITIES:
+            image = original.copy()
+            image.thumbnail((width * density, height * density), Image.LANCZOS)
+            for extension, image_format in rendition_formats():
+                buffer = BytesIO()
+                if image_format == 'JPEG':
+                    _flatten(image).save(buffer, image_format, quality=JPEG_QUALITY, optimize=True, progressive=True)
+                else:
+                    image.save(buffer, image_format, quality=WEBP_QUALITY, method=4)
+                name = rendition_name(field_file.name, preset, density, extension)
+                if storage.exists(name):
+                    storage.delete(name)
+                created.append(storage.save(name, ContentFile(buffer.getvalue())))
+    return created
+
+
+def renditions_missing(field_file, presets):
+    return any(
+        not field_file.storage.exists(rendition_name(field_file.name, preset)) for preset in presets
+    )
+
+
+def rendition_fields(instance):
+    return RENDITION_FIELDS.get(instance._meta.label_lower, {})
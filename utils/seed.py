@@ -0,0 +1,169 @@
+import random
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max
+
+BATCH_SIZE = 500
+SEED_PASSWORD = 'seed-password'
+SEED_IMAGE = 'seed/placeholder.jpg'
+SEED_VOLUMES = ('0,375 л', '0,5 л', '0,7 л', '1 л')
+SEED_COUNTRIES = ('Франция', 'Италия', 'Шотландия', 'Россия', 'Мексика')
+
+# feature name, filter name, unit, value type, values
+SEED_FEATURES = (
+    ('Крепость', 'strength', '%', 'decimal', ('12', '18,5', '37,5', '40', '43', '47,3')),
+    ('Выдержка', 'age', 'лет', 'int', ('3', '5', '8', '12', '18')),
+    ('Регион', 'region', None, 'string', ('Коньяк', 'Тоскана', 'Спейсайд', 'Айла', 'Халиско')),
+    ('Цвет', 'color', None, 'string', ('Белый', 'Красный', 'Янтарный', 'Прозрачный')),
+)
+
+
+class SeededCatalog:
+
+    def __init__(self, categories, brands, products, customers, features):
+        self.categories = categories
+        self.brands = brands
+        self.products = products
+        self.customers = customers
+        self.features = features
+
+    def counts(self):
+        return {
+            'categories': len(self.categories),
+            'brands': len(self.brands),
+            'products': len(self.products),
+            'customers': len(self.customers),
+            'features': len(self.features),
+        }
+
+
+# bulk_create does not return primary keys on every backend (SQLite on Django 3.2),
+# so the created rows are read back in insertion order
+def _bulk_create(model, objects):
+    last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    model.objects.bulk_create(objects, batch_size=BATCH_SIZE)
+    return list(model.objects.filter(id__gt=last_id).order_by('id'))
+
+
+# deterministic synthetic catalog for benchmarks and query-count tests; rows are bulk created,
+# so the search / autocomplete / facet indexes are rebuilt once at the end instead of per save
+def seed_catalog(products=200, categories=4, brands=10, customers=5, orders_per_customer=2,
+                 cart_lines=3, seed=0):
+    from alcohol.autocomplete import bump_version as bump_autocomplete_version
+    from alcohol.models import (
+        Address, BottleVolume, Brand, Cart, CartProduct, Category, Country, Customer, Order, Product, User
+    )
+    from alcohol.search import search_index
+    from specs.facets import FACETS_GENERATION, facet_index
+    from specs.models import CategoryFeature, ProductFeatures
+    from specs.values import parse_number
+    from utils.generations import bump as bump_generations
+
+    rnd = random.Random(seed)
+    with transaction.atomic():
+        countries = _bulk_create(Country, [
+            Country(name=name, slug=f'seed-country-{i}') for i, name in enumerate(SEED_COUNTRIES)
+        ])
+        volumes = _bulk_create(BottleVolume, [BottleVolume(name=name) for name in SEED_VOLUMES])
+        category_list = _bulk_create(Category, [
+            Category(name=f'Категория {i}', slug=f'seed-category-{i}') for i in range(categories)
+        ])
+        brand_list = _bulk_create(Brand, [
+            Brand(name=f'Бренд {i}', slug=f'seed-brand-{i}', since_date=date(1800 + i, 1, 1),
+                  country=rnd.choice(countries), image=SEED_IMAGE)
+            for i in range(brands)
+        ])
+        Brand.category.through.objects.bulk_create([
+            Brand.category.through(brand_id=brand.id, category_id=category.id)
+            for brand in brand_list for category in category_list
+        ], batch_size=BATCH_SIZE)
+
+        feature_list = _bulk_create(CategoryFeature, [
+            CategoryFeature(category=category, feature_name=name, feature_filter_name=filter_name, unit=unit,
+                            value_type=value_type)
+            for category in category_list for name, filter_name, unit, value_type, values in SEED_FEATURES
+        ])
+        Category.features.through.objects.bulk_create([
+            Category.features.through(category_id=feature.category_id, categoryfeature_id=feature.id)
+            for feature in feature_list
+        ], batch_size=BATCH_SIZE)
+        feature_values = {name: values for name, filter_name, unit, value_type, values in SEED_FEATURES}
+        features_by_category = {}
+        for feature in feature_list:
+            features_by_category.setdefault(feature.category_id, []).append(feature)
+
+        product_list = _bulk_create(Product, [
+            Product(name=f'Товар {i}', slug=f'seed-product-{i}', category=category_list[i % categories],
+                    brand=rnd.choice(brand_list), volume=rnd.choice(volumes),
+                    price=Decimal(rnd.randrange(300, 30000)), stock=rnd.randrange(1, 50),
+                    out_of_stock=rnd.random() < 0.1, offer_of_the_week=rnd.random() < 0.05, image=SEED_IMAGE)
+            for i in range(products)
+        ])
+        product_features = _bulk_create(ProductFeatures, [
+            ProductFeatures(product_id=product.id, feature=feature, value=value,
+                            numeric_value=parse_number(value) if feature.is_numeric else None)
+            for product in product_list for feature in features_by_category[product.category_id]
+            for value in [rnd.choice(feature_values[feature.feature_name])]
+        ])
+        Product.features.through.objects.bulk_create([
+            Product.features.through(product_id=product_feature.product_id, productfeatures_id=product_feature.id)
+            for product_feature in product_features
+        ], batch_size=BATCH_SIZE)
+
+        password = make_password(SEED_PASSWORD)
+        users = _bulk_create(User, [
+            User(username=f'seed-customer-{i}', first_name=f'Покупатель {i}', last_name='Тестовый',
+                 email=f'seed-customer-{i}@example.com', password=password)
+            for i in range(customers)
+        ])
+        customer_list = _bulk_create(Customer, [
+            Customer(user=user, phone=f'+7900000{i:04d}', birth_date=date(1990, 1, 1), agreement=True)
+            for i, user in enumerate(users)
+        ])
+        addresses = _bulk_create(Address, [
+            Address(customer=customer, city='Москва', street=f'Тестовая улица, {i}', building=str(i + 1))
+            for i, customer in enumerate(customer_list)
+        ])
+        Customer.user_addresses.through.objects.bulk_create([
+            Customer.user_addresses.through(customer_id=address.customer_id, address_id=address.id)
+            for address in addresses
+        ], batch_size=BATCH_SIZE)
+
+        carts = _bulk_create(Cart, [
+            Cart(owner=customer, in_order=i < orders_per_customer)
+            for customer in customer_list for i in range(orders_per_customer + 1)
+        ])
+        content_type = ContentType.objects.get_for_model(Product)
+        lines = []
+        for cart in carts:
+            for product in rnd.sample(product_list, min(cart_lines, len(product_list))):
+                qty = rnd.randrange(1, 4)
+                lines.append(CartProduct(user_id=cart.owner_id, cart=cart, content_type=content_type,
+                                         object_id=product.id, product=product, qty=qty,
+                                         final_price=qty * product.price))
+                cart.total_products += qty
+                cart.final_price += qty * product.price
+        lines = _bulk_create(CartProduct, lines)
+        Cart.products.through.objects.bulk_create([
+            Cart.products.through(cart_id=line.cart_id, cartproduct_id=line.id) for line in lines
+        ], batch_size=BATCH_SIZE)
+        Cart.objects.bulk_update(carts, ['total_products', 'final_price'], batch_size=BATCH_SIZE)
+        customers_by_id = {customer.id: (customer, user) for customer, user in zip(customer_list, users)}
+        addresses_by_customer = {address.customer_id: address for address in addresses}
+        Order.objects.bulk_create([
+            Order(customer_id=cart.owner_id, address=addresses_by_customer[cart.owner_id], cart=cart,
+                  first_name=customers_by_id[cart.owner_id][1].first_name,
+                  last_name=customers_by_id[cart.owner_id][1].last_name,
+                  phone=customers_by_id[cart.owner_id][0].phone)
+            for cart in carts if cart.in_order
+        ], batch_size=BATCH_SIZE)
+
+    search_index.rebuild()
+    facet_index.invalidate()
+    bump_generations(*[FACETS_GENERATION.format(category_id=category.id) for category in category_list])
+    bump_autocomplete_version()
+    return SeededCatalog(category_list, brand_list, product_list, customer_list, feature_list)
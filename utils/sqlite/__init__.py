@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+# Outermost atomic block that takes the write lock at BEGIN. A deferred transaction that reads first
+# cannot upgrade to a write lock while another worker writes and fails with "database is locked"
+# at once instead of waiting busy_timeout; short immediate transactions just queue up.
+# Other databases and the stock SQLite engine get a plain atomic block
+@contextmanager
+def immediate_atomic(using=None):
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if (not hasattr(connection, 'begin_immediate') or connection.in_atomic_block
+            or not getattr(settings, 'SQLITE_IMMEDIATE_TRANSACTIONS', True)):
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
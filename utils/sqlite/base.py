@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+# django.db.backends.sqlite3 with the SQLITE_PRAGMAS profile applied to every new connection
+# and "BEGIN IMMEDIATE" for utils.sqlite.immediate_atomic
+class DatabaseWrapper(base.DatabaseWrapper):
+    begin_immediate = False
+
+    def init_connection_state(self):
+        super().init_connection_state()
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            self.connection.execute(f'PRAGMA {pragma} = {value}')
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE' if self.begin_immediate else 'BEGIN')